@@ -0,0 +1,42 @@
+#############################################################################################################
+# Access to the integration's modules from the benchmarks.
+#  The component directory is registered as a bare package so that its modules can be imported without
+#  running the Home Assistant setup code in its __init__.py.
+#############################################################################################################
+
+import importlib
+import os
+import sys
+import types
+
+import yaml
+
+COMPONENT_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'custom_components', 'solarman')
+DEFINITIONS_DIR = os.path.join(COMPONENT_DIR, 'inverter_definitions')
+PACKAGE = 'solarman_component'
+
+
+def load(module):
+    if PACKAGE not in sys.modules:
+        package = types.ModuleType(PACKAGE)
+        package.__path__ = [COMPONENT_DIR]
+        sys.modules[PACKAGE] = package
+    return importlib.import_module(f'{PACKAGE}.{module}')
+
+
+def definitions():
+    # Yield (file name, definition) for every inverter definition that loads
+    for name in sorted(os.listdir(DEFINITIONS_DIR)):
+        if not name.endswith('.yaml'):
+            continue
+        try:
+            with open(os.path.join(DEFINITIONS_DIR, name)) as f:
+                yield name, yaml.safe_load(f)
+        except yaml.YAMLError as e:
+            print(f'Skipping {name}: {type(e).__name__}', file=sys.stderr)
+
+
+def blocks(definition):
+    # Yield (start, length) for every request block of the definition
+    for request in definition['requests']:
+        yield request['start'], request['end'] - request['start'] + 1
@@ -0,0 +1,226 @@
+#############################################################################################################
+# A simulated Solarman V5 data logger.
+#  Serves the registers of an inverter definition over the V5 protocol, with configurable latency, jitter,
+#  dropped requests and malformed replies, so that Inverter can be exercised without hardware.
+#
+#  The registers come from a capture of a real device (see the capture command) or, without a capture, are
+#  synthesized from the definition: values that pass its validation rules and valid keys for lookups.
+#
+#  Usage: python benchmarks/fake_logger.py serve deye_hybrid.yaml [--port 8899] [--latency 0.1] ...
+#         python benchmarks/fake_logger.py capture deye_hybrid.yaml HOST SERIAL [--port 8899] -o capture.json
+#############################################################################################################
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import struct
+import sys
+
+import yaml
+
+import component
+
+protocol = component.load('protocol')
+
+MAX_READ_QUANTITY = 125
+
+
+class RegisterMap:
+    def __init__(self, registers = None):
+        # {function code: {register: value}}
+        self.registers = registers if registers is not None else {0x03: {}, 0x04: {}}
+
+    def read(self, mb_fc, start, quantity):
+        values = self.registers.get(mb_fc, {})
+        return [values.get(r, 0) for r in range(start, start + quantity)]
+
+    def write(self, start, values):
+        holding = self.registers.setdefault(0x03, {})
+        for i, value in enumerate(values):
+            holding[start + i] = value
+
+    @classmethod
+    def synthesize(cls, definition, seed = 1):
+        rnd = random.Random(seed)
+        register_map = cls()
+        for request in definition['requests']:
+            values = register_map.registers.setdefault(request['mb_functioncode'], {})
+            for r in range(request['start'], request['end'] + 1):
+                values.setdefault(r, rnd.randrange(1, 1000))
+        for i in definition['parameters']:
+            for j in i['items']:
+                if not j['registers']:
+                    continue
+                if 'lookup' in j and j['lookup']:
+                    raw = rnd.choice(j['lookup'])['key']
+                elif 'validation' in j:
+                    # Halfway between the bounds, or just above the minimum
+                    low = j['validation'].get('min') or 0
+                    high = j['validation'].get('max', low + 1000)
+                    raw = int(((low + high) / 2 / (j.get('scale') or 1) + j.get('offset', 0)) * (j.get('scale_division') or 1))
+                else:
+                    continue
+                raw = max(0, raw)
+                for k, r in enumerate(j['registers']):
+                    for values in register_map.registers.values():
+                        if r in values:
+                            values[r] = (raw >> (16 * k)) & 0xFFFF
+        return register_map
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            capture = json.load(f)
+        return cls({int(fc): {int(r, 0): v for r, v in values.items()} for fc, values in capture['registers'].items()})
+
+    def save(self, path, profile):
+        capture = {'profile': profile, 'registers': {str(fc): {hex(r): v for r, v in sorted(values.items())} for fc, values in self.registers.items()}}
+        with open(path, 'w') as f:
+            json.dump(capture, f, indent=1)
+
+
+class FakeLogger:
+    def __init__(self, register_map, latency = 0.0, jitter = 0.0, drop = 0.0, malformed = 0.0, pipelining = True, seed = 1):
+        self.register_map = register_map
+        self.latency = latency
+        self.jitter = jitter
+        self.drop = drop
+        self.malformed = malformed
+        # Without pipelining, requests arriving while one is being answered are ignored, as some loggers do
+        self.pipelining = pipelining
+        self.requests = 0
+        self.bytes_sent = 0
+        self._random = random.Random(seed)
+        self._server = None
+
+    async def start(self, host = '127.0.0.1', port = 0):
+        self._server = await asyncio.start_server(self._serve, host, port)
+        return self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def _serve(self, reader, writer):
+        replies = set()
+        try:
+            while True:
+                header = await reader.readexactly(3)
+                if header[0] != protocol.V5_START:
+                    continue
+                length = struct.unpack_from('<H', header, 1)[0]
+                frame = header + await reader.readexactly(length + protocol.V5_HEADER_LENGTH + protocol.V5_TRAILER_LENGTH - 3)
+                if replies and not self.pipelining:
+                    continue
+                reply = asyncio.create_task(self._reply(frame, writer))
+                replies.add(reply)
+                reply.add_done_callback(replies.discard)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            for reply in replies:
+                reply.cancel()
+            writer.close()
+
+    async def _reply(self, frame, writer):
+        control, sequence, serial, payload = protocol.decode_v5_frame(frame)
+        if control != protocol.CONTROL_REQUEST:
+            return
+        self.requests += 1
+        await asyncio.sleep(max(0.0, self.latency + self._random.uniform(-self.jitter, self.jitter)))
+        if self._random.random() < self.drop:
+            return
+        modbus = self._modbus_reply(payload[len(protocol.REQUEST_PAYLOAD_HEADER):])
+        reply = protocol.encode_v5_frame(protocol.CONTROL_RESPONSE, sequence, serial, bytes(protocol.RESPONSE_PAYLOAD_HEADER_LENGTH) + modbus)
+        if self._random.random() < self.malformed:
+            reply = bytearray(reply)
+            reply[-3] ^= 0xFF
+            reply = bytes(reply)
+        self.bytes_sent += len(reply)
+        writer.write(reply)
+        await writer.drain()
+
+    def _modbus_reply(self, request):
+        slave_id, mb_fc, register, quantity = struct.unpack_from('>BBHH', request)
+        if mb_fc in (0x03, 0x04) and quantity > MAX_READ_QUANTITY:
+            # Illegal data value, as the inverter answers reads beyond the Modbus limit
+            return protocol.with_crc(struct.pack('>BBB', slave_id, mb_fc | 0x80, 0x03))
+        if mb_fc in (0x03, 0x04):
+            values = self.register_map.read(mb_fc, register, quantity)
+            return protocol.with_crc(struct.pack(f'>BBB{quantity}H', slave_id, mb_fc, 2 * quantity, *values))
+        if mb_fc == 0x06:
+            self.register_map.write(register, [quantity])
+        elif mb_fc == 0x10:
+            self.register_map.write(register, list(struct.unpack_from(f'>{quantity}H', request, 7)))
+        else:
+            return protocol.with_crc(struct.pack('>BBB', slave_id, mb_fc | 0x80, 0x01))
+        return protocol.with_crc(request[:6])
+
+
+def load_definition(name):
+    with open(os.path.join(component.DEFINITIONS_DIR, name)) as f:
+        return yaml.safe_load(f)
+
+
+async def serve(args):
+    definition = load_definition(args.definition)
+    register_map = RegisterMap.load(args.capture) if args.capture else RegisterMap.synthesize(definition, args.seed)
+    logger = FakeLogger(register_map, args.latency, args.jitter, args.drop, args.malformed, not args.no_pipelining, args.seed)
+    port = await logger.start(args.host, args.port)
+    print(f'Serving {args.definition} on {args.host}:{port}', file=sys.stderr)
+    await asyncio.Event().wait()
+
+
+async def capture(args):
+    definition = load_definition(args.definition)
+    client = protocol.V5Client(args.host, args.serial, port=args.port, mb_slave_id=args.mb_slaveid)
+    await client.connect()
+    register_map = RegisterMap()
+    try:
+        for request in definition['requests']:
+            quantity = request['end'] - request['start'] + 1
+            if request['mb_functioncode'] == 0x04:
+                values = await client.read_input_registers(request['start'], quantity)
+            else:
+                values = await client.read_holding_registers(request['start'], quantity)
+            register_map.registers.setdefault(request['mb_functioncode'], {}).update(zip(range(request['start'], request['start'] + quantity), values))
+    finally:
+        await client.disconnect()
+    register_map.save(args.output, args.definition)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='Simulated Solarman V5 data logger')
+    commands = arg_parser.add_subparsers(dest='command', required=True)
+
+    serve_parser = commands.add_parser('serve', help='serve the registers of a definition')
+    serve_parser.add_argument('definition', help='file name in inverter_definitions/')
+    serve_parser.add_argument('--capture', help='registers captured from a device (default: synthesized)')
+    serve_parser.add_argument('--host', default='127.0.0.1')
+    serve_parser.add_argument('--port', type=int, default=8899)
+    serve_parser.add_argument('--latency', type=float, default=0.0, help='seconds before each reply')
+    serve_parser.add_argument('--jitter', type=float, default=0.0, help='random seconds added to or removed from the latency')
+    serve_parser.add_argument('--drop', type=float, default=0.0, help='fraction of requests left unanswered')
+    serve_parser.add_argument('--malformed', type=float, default=0.0, help='fraction of replies with a bad checksum')
+    serve_parser.add_argument('--no-pipelining', action='store_true', help='ignore requests received while answering one')
+    serve_parser.add_argument('--seed', type=int, default=1)
+
+    capture_parser = commands.add_parser('capture', help='capture the registers of a device')
+    capture_parser.add_argument('definition', help='file name in inverter_definitions/')
+    capture_parser.add_argument('host')
+    capture_parser.add_argument('serial', type=int)
+    capture_parser.add_argument('--port', type=int, default=8899)
+    capture_parser.add_argument('--mb-slaveid', type=int, default=1)
+    capture_parser.add_argument('-o', '--output', required=True)
+
+    args = arg_parser.parse_args()
+    try:
+        asyncio.run(serve(args) if args.command == 'serve' else capture(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+#############################################################################################################
+# Throughput of the headless poller (custom_components/solarman/fleet.py)
+#  Polls N inverters behind simulated data loggers (fake_logger.py), to measure how many inverters one core
+#  keeps up with. A real fleet is polled with: python -m custom_components.solarman.fleet fleet.yaml
+#
+#  Usage: python benchmarks/fleet_poller.py --simulate 40 [--definition deye_hybrid.yaml] [--per-logger 1]
+#                                           [--latency 0.05] [--interval 5] [--duration 60] [-o /dev/null]
+#############################################################################################################
+
+import argparse
+import asyncio
+import logging
+import sys
+
+import component
+
+fleet = component.load('fleet')
+
+
+async def simulated_fleet(args):
+    # Start the simulated loggers and return the fleet entries and the loggers
+    from fake_logger import FakeLogger, RegisterMap, load_definition
+    register_map = RegisterMap.synthesize(load_definition(args.definition), args.seed)
+    entries = []
+    loggers = []
+    for i in range(0, args.simulate, args.per_logger):
+        logger = FakeLogger(register_map, args.latency, args.jitter, seed=args.seed + i)
+        port = await logger.start()
+        loggers.append(logger)
+        for slave in range(1, min(args.per_logger, args.simulate - i) + 1):
+            entries.append({'name': f'sim-{i + slave}', 'host': '127.0.0.1', 'port': port, 'serial': 1000000000 + i,
+                            'mb_slaveid': slave, 'lookup_file': args.definition, 'path': fleet.DEFINITIONS_PATH, 'interval': None})
+    return entries, loggers
+
+
+async def run(args, output):
+    entries, loggers = await simulated_fleet(args)
+    poller = fleet.FleetPoller(entries, output, args.concurrency, args.interval)
+    try:
+        await poller.run(args.duration)
+    finally:
+        for logger in loggers:
+            await logger.stop()
+        print(poller.summary(), file=sys.stderr)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='Throughput of the headless poller with simulated inverters')
+    arg_parser.add_argument('-o', '--output', help='file to append the JSON lines to (default: stdout)')
+    arg_parser.add_argument('--concurrency', type=int, default=fleet.DEFAULT_CONCURRENCY, help='polls running at once')
+    arg_parser.add_argument('--interval', type=float, default=fleet.DEFAULT_INTERVAL, help='seconds between polls of an inverter without an interval')
+    arg_parser.add_argument('--duration', type=float, help='seconds to run (default: until interrupted)')
+    arg_parser.add_argument('--simulate', type=int, default=40, help='number of simulated inverters')
+    arg_parser.add_argument('--definition', default='deye_hybrid.yaml', help='definition of the simulated inverters')
+    arg_parser.add_argument('--per-logger', type=int, default=1, help='simulated inverters behind each logger')
+    arg_parser.add_argument('--latency', type=float, default=0.05, help='seconds before each reply of the simulated loggers')
+    arg_parser.add_argument('--jitter', type=float, default=0.0, help='random seconds added to or removed from the latency')
+    arg_parser.add_argument('--seed', type=int, default=1)
+    arg_parser.add_argument('-v', '--verbose', action='store_true')
+    args = arg_parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.WARNING, stream=sys.stderr)
+    output = open(args.output, 'a') if args.output else sys.stdout
+    try:
+        asyncio.run(run(args, output))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+
+if __name__ == '__main__':
+    main()
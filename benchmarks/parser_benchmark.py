@@ -0,0 +1,74 @@
+#############################################################################################################
+# Microbenchmark of ParameterParser.parse
+#  Compares the compiled per-field decoders against the interpretive baseline in legacy_parser.py for every
+#  file in inverter_definitions/, after checking that both produce the same result. The snapshot column is
+#  RegisterSnapshot.update, with a fraction of the registers changing from one poll to the next.
+#
+#  Usage: python benchmarks/parser_benchmark.py [--polls N] [--seed N] [--changed 0.1]
+#############################################################################################################
+
+import argparse
+import random
+import timeit
+
+import component
+import legacy_parser
+
+
+def synthetic_registers(definition, seed):
+    # Register values small enough to pass the validation rules of the shipped definitions
+    rnd = random.Random(seed)
+    return [(start, length, [rnd.randrange(1, 1000) for _ in range(length)]) for start, length in component.blocks(definition)]
+
+
+def poll(parser_class, definition, registers, *args):
+    params = parser_class(definition, *args)
+    for start, length, raw in registers:
+        params.parse(raw, start, length)
+    return params.get_result()
+
+
+def snapshot_polls(parser, plan, registers, changed, seed):
+    # The registers of each poll, with a fraction of them changed from the previous poll
+    rnd = random.Random(seed)
+    polls = []
+    for i in range(2):
+        registers = [(start, length, [v if rnd.random() >= changed else rnd.randrange(1, 1000) for v in raw]) for start, length, raw in registers]
+        polls.append(registers)
+    snapshots = {(start, length): parser.RegisterSnapshot(plan[(start, length)], length) for start, length, raw in registers}
+    return snapshots, polls
+
+
+def poll_snapshots(snapshots, registers):
+    for start, length, raw in registers:
+        snapshots[(start, length)].update(raw)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='Microbenchmark of ParameterParser.parse')
+    arg_parser.add_argument('--polls', type=int, default=2000, help='polls to time per definition')
+    arg_parser.add_argument('--seed', type=int, default=1)
+    arg_parser.add_argument('--changed', type=float, default=0.1, help='fraction of the registers changing between polls')
+    args = arg_parser.parse_args()
+
+    parser = component.load('parser')
+    print(f'{"definition":<30}{"fields":>8}{"legacy us":>12}{"compiled us":>13}{"speedup":>9}{"snapshot us":>13}')
+    for name, definition in component.definitions():
+        registers = synthetic_registers(definition, args.seed)
+        plan = parser.compile_plan(definition)
+        expected = poll(legacy_parser.ParameterParser, definition, registers)
+        actual = poll(parser.ParameterParser, definition, registers, plan)
+        if expected != actual:
+            raise SystemExit(f'{name}: compiled parser output differs from the legacy parser')
+
+        legacy = timeit.timeit(lambda: poll(legacy_parser.ParameterParser, definition, registers), number=args.polls)
+        compiled = timeit.timeit(lambda: poll(parser.ParameterParser, definition, registers, plan), number=args.polls)
+        snapshots, polls = snapshot_polls(parser, plan, registers, args.changed, args.seed)
+        # Alternate between two polls differing by the changed fraction
+        snapshot = timeit.timeit(lambda: [poll_snapshots(snapshots, p) for p in polls], number=args.polls // 2) / (args.polls // 2 * 2)
+        fields = sum(len(i['items']) for i in definition['parameters'])
+        print(f'{name:<30}{fields:>8}{legacy / args.polls * 1e6:>12.1f}{compiled / args.polls * 1e6:>13.1f}{legacy / compiled:>8.1f}x{snapshot * 1e6:>13.1f}')
+
+
+if __name__ == '__main__':
+    main()
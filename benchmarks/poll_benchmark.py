@@ -0,0 +1,129 @@
+#############################################################################################################
+# Benchmark of Inverter polls against the simulated data logger in fake_logger.py
+#  For every definition in inverter_definitions/ (or those given), measures:
+#   - the latency of a poll (Inverter.get_statistics) with the simulated network latency and jitter
+#   - the CPU time of a poll, and the part of it spent in ParameterParser.parse
+#   - the memory held by each inverter as the number of inverters polled together grows
+#
+#  Usage: python benchmarks/poll_benchmark.py [deye_hybrid.yaml ...] [--polls N] [--latency 0.01] [--jitter 0.005]
+#                                             [--drop 0.0] [--malformed 0.0] [--timeout 15] [--inverters 1,10,50]
+#                                             [--capture FILE]
+#############################################################################################################
+
+import argparse
+import asyncio
+import gc
+import logging
+import statistics
+import time
+import tracemalloc
+
+import component
+from fake_logger import FakeLogger, RegisterMap, load_definition
+
+solarman = component.load('solarman')
+parser = component.load('parser')
+
+SERIAL = 1234567890
+
+
+def new_inverter(name, port, serial = SERIAL):
+    return solarman.Inverter(component.DEFINITIONS_DIR + '/', serial, '127.0.0.1', port, 1, name)
+
+
+def force_poll(inverter):
+    # Make every block due, as on the first poll
+    inverter._next_query = [0] * len(inverter._next_query)
+
+
+def parse_time(definition, register_map, polls):
+    # CPU seconds per poll spent decoding the blocks, without the network
+    plan = parser.compile_plan(definition)
+    blocks = [(start, length, register_map.read(r['mb_functioncode'], start, length))
+              for r, (start, length) in zip(definition['requests'], component.blocks(definition))]
+    begin = time.process_time()
+    for _ in range(polls):
+        params = parser.ParameterParser(definition, plan)
+        for start, length, raw in blocks:
+            params.parse(raw, start, length)
+    return (time.process_time() - begin) / polls
+
+
+async def poll_latency(name, register_map, args):
+    logger = FakeLogger(register_map, args.latency, args.jitter, args.drop, args.malformed, seed=args.seed)
+    port = await logger.start()
+    inverter = new_inverter(name, port)
+    try:
+        await inverter.get_statistics()
+        latencies = []
+        begin_cpu = time.process_time()
+        for _ in range(args.polls):
+            force_poll(inverter)
+            begin = time.perf_counter()
+            await inverter.get_statistics()
+            latencies.append(time.perf_counter() - begin)
+        cpu = (time.process_time() - begin_cpu) / args.polls
+        values = len(inverter.get_current_val() or {})
+    finally:
+        await inverter.close()
+        await logger.stop()
+    return latencies, cpu, values, logger.requests
+
+
+async def memory_per_inverter(name, register_map, count):
+    # Bytes allocated per polled inverter, each with a logger connection of its own
+    logger = FakeLogger(register_map)
+    port = await logger.start()
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    inverters = [new_inverter(name, port, SERIAL + i) for i in range(count)]
+    try:
+        await asyncio.gather(*(i.get_statistics() for i in inverters))
+        gc.collect()
+        used = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+        await asyncio.gather(*(i.close() for i in inverters))
+        await logger.stop()
+    return used / count
+
+
+async def run(args):
+    names = args.definitions or [name for name, definition in component.definitions()]
+    counts = [int(c) for c in args.inverters.split(',')]
+    print(f'{"definition":<30}{"values":>7}{"requests":>9}{"mean ms":>9}{"p95 ms":>8}{"cpu us":>8}{"parse us":>9}'
+          + ''.join(f'{f"KiB@{c}":>9}' for c in counts))
+    for name in names:
+        definition = load_definition(name)
+        register_map = RegisterMap.load(args.capture) if args.capture else RegisterMap.synthesize(definition, args.seed)
+        latencies, cpu, values, requests = await poll_latency(name, register_map, args)
+        p95 = statistics.quantiles(latencies, n=20)[-1] if len(latencies) > 1 else latencies[0]
+        parse = parse_time(definition, register_map, args.polls)
+        memory = [await memory_per_inverter(name, register_map, c) for c in counts]
+        print(f'{name:<30}{values:>7}{requests:>9}{statistics.mean(latencies) * 1e3:>9.2f}{p95 * 1e3:>8.2f}'
+              f'{cpu * 1e6:>8.0f}{parse * 1e6:>9.1f}' + ''.join(f'{m / 1024:>9.1f}' for m in memory))
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='Benchmark of Inverter polls against a simulated data logger')
+    arg_parser.add_argument('definitions', nargs='*', help='file names in inverter_definitions/ (default: all)')
+    arg_parser.add_argument('--polls', type=int, default=200, help='polls to time per definition')
+    arg_parser.add_argument('--latency', type=float, default=0.0, help='seconds before each reply')
+    arg_parser.add_argument('--jitter', type=float, default=0.0, help='random seconds added to or removed from the latency')
+    arg_parser.add_argument('--drop', type=float, default=0.0, help='fraction of requests left unanswered')
+    arg_parser.add_argument('--malformed', type=float, default=0.0, help='fraction of replies with a bad checksum')
+    arg_parser.add_argument('--timeout', type=float, default=solarman.QUERY_TIMEOUT, help='seconds to wait for a reply before retrying')
+    arg_parser.add_argument('--inverters', default='1,10,50', help='numbers of inverters to measure the memory with')
+    arg_parser.add_argument('--capture', help='registers captured from a device (default: synthesized)')
+    arg_parser.add_argument('--seed', type=int, default=1)
+    args = arg_parser.parse_args()
+
+    # Failed requests are expected with --drop and --malformed
+    logging.basicConfig(level=logging.ERROR)
+    solarman.QUERY_TIMEOUT = args.timeout
+    asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,13 +1,16 @@
 """The Solarman Collector integration."""
+from __future__ import annotations
 
 import logging
-
-from homeassistant.core import HomeAssistant
-from homeassistant.config_entries import ConfigEntry
-from homeassistant.const import CONF_NAME
+from typing import TYPE_CHECKING
 
 from .const import *
 
+# Home Assistant is only imported where needed, so that the poller in fleet.py runs without it
+if TYPE_CHECKING:
+    from homeassistant.core import HomeAssistant
+    from homeassistant.config_entries import ConfigEntry
+
 _LOGGER = logging.getLogger(__name__)
 
 PLATFORMS: list[str] = ["sensor"]
@@ -25,12 +28,14 @@ async def async_unload_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
     _LOGGER.debug(f'__init__.py:async_unload_entry({entry.as_dict()})')
     unload_ok = await hass.config_entries.async_unload_platforms(entry, PLATFORMS)
     if unload_ok:
-        hass.data[DOMAIN].pop(entry.entry_id)
+        hass.data[DOMAIN].pop(entry.entry_id, None)
     return unload_ok
 
 
 async def update_listener(hass: HomeAssistant, entry: ConfigEntry) -> None:
     """Handle options update."""
     _LOGGER.debug(f'__init__.py:update_listener({entry.as_dict()})')
-    hass.data[DOMAIN][entry.entry_id].config(entry)
+    from homeassistant.const import CONF_NAME
     entry.title = entry.options[CONF_NAME]
+    # The inverter is set up again with the new options
+    await hass.config_entries.async_reload(entry.entry_id)
@@ -21,7 +21,7 @@ from .const import *
 _LOGGER = logging.getLogger(__name__)
 
 
-def step_user_data_schema(data: dict[str, Any] = {CONF_NAME: SENSOR_PREFIX, CONF_INVERTER_PORT: DEFAULT_PORT_INVERTER, CONF_INVERTER_MB_SLAVEID: DEFAULT_INVERTER_MB_SLAVEID, CONF_LOOKUP_FILE: DEFAULT_LOOKUP_FILE}) -> Schema:
+def step_user_data_schema(lookup_files: list[str], data: dict[str, Any] = {CONF_NAME: SENSOR_PREFIX, CONF_INVERTER_PORT: DEFAULT_PORT_INVERTER, CONF_INVERTER_MB_SLAVEID: DEFAULT_INVERTER_MB_SLAVEID, CONF_LOOKUP_FILE: DEFAULT_LOOKUP_FILE}) -> Schema:
     _LOGGER.debug(f'config_flow.py:step_user_data_schema: {data}')
     STEP_USER_DATA_SCHEMA = vol.Schema(
         {
@@ -30,7 +30,8 @@ def step_user_data_schema(data: dict[str, Any] = {CONF_NAME: SENSOR_PREFIX, CONF
             vol.Required(CONF_INVERTER_SERIAL, default=data.get(CONF_INVERTER_SERIAL)): int,
             vol.Optional(CONF_INVERTER_PORT, default=data.get(CONF_INVERTER_PORT)): int,
             vol.Optional(CONF_INVERTER_MB_SLAVEID, default=data.get(CONF_INVERTER_MB_SLAVEID)): int,
-            vol.Optional(CONF_LOOKUP_FILE, default=data.get(CONF_LOOKUP_FILE)): vol.In(LOOKUP_FILES),
+            vol.Optional(CONF_LOOKUP_FILE, default=data.get(CONF_LOOKUP_FILE)): vol.In(lookup_files),
+            vol.Optional(CONF_HISTORY_SIZE, default=data.get(CONF_HISTORY_SIZE, 0)): vol.All(int, vol.Range(min=0)),
         },
         extra=vol.PREVENT_EXTRA
     )
@@ -49,8 +50,9 @@ async def validate_input(hass: HomeAssistant, data: dict[str, Any]) -> dict[str,
     _LOGGER.debug(f'config_flow.py:validate_input: {data}')
 
     try:
-        getaddrinfo(
-            data[CONF_INVERTER_HOST], data[CONF_INVERTER_PORT], family=0, type=0, proto=0, flags=0
+        # The name is resolved in the executor, not to block the event loop
+        await hass.async_add_executor_job(
+            getaddrinfo, data[CONF_INVERTER_HOST], data[CONF_INVERTER_PORT], 0, 0, 0, 0
         )
     except herror:
         raise InvalidHost
@@ -81,7 +83,7 @@ class ConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
         """Handle the initial step."""
         if user_input is None:
             return self.async_show_form(
-                step_id="user", data_schema=step_user_data_schema()
+                step_id="user", data_schema=step_user_data_schema(await self.hass.async_add_executor_job(list_lookup_files))
             )
 
         errors = {}
@@ -107,7 +109,7 @@ class ConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
 
         return self.async_show_form(
             step_id="user",
-            data_schema=step_user_data_schema(user_input),
+            data_schema=step_user_data_schema(await self.hass.async_add_executor_job(list_lookup_files), user_input),
             errors=errors,
         )
 
@@ -128,7 +130,7 @@ class OptionsFlow(config_entries.OptionsFlow):
         if user_input is None:
             return self.async_show_form(
                 step_id="init",
-                data_schema=step_user_data_schema(self.entry.options),
+                data_schema=step_user_data_schema(await self.hass.async_add_executor_job(list_lookup_files), self.entry.options),
             )
 
         errors = {}
@@ -147,7 +149,7 @@ class OptionsFlow(config_entries.OptionsFlow):
 
         return self.async_show_form(
             step_id="init",
-            data_schema=step_user_data_schema(user_input),
+            data_schema=step_user_data_schema(await self.hass.async_add_executor_job(list_lookup_files), user_input),
             errors=errors,
         )
 
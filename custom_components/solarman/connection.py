@@ -0,0 +1,219 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import random
+import time
+
+from .protocol import V5Client
+
+log = logging.getLogger(__name__)
+
+# An idle connection is probed after this many seconds without traffic
+KEEPALIVE_INTERVAL = 60
+# Delay before reconnecting after a failed attempt, doubling up to the maximum and randomized by up to half
+BACKOFF_INITIAL = 1
+BACKOFF_MAX = 300
+
+# Priorities of the requests waiting for a connection, lowest first
+PRIORITY_WRITE = 0
+PRIORITY_NORMAL = 1
+
+
+def is_transport_error(e):
+    # Connection refused/reset/closed and timeouts, as opposed to errors reported over a working connection
+    return isinstance(e, (OSError, asyncio.TimeoutError))
+
+
+#############################################################################################################
+# A lock granted by priority, then in FIFO order among requests of the same priority.
+#  "async with lock" waits with the normal priority, "async with lock.priority(p)" with another one. The lock
+#  is handed over to the next waiter on release, so a newcomer never overtakes the queue.
+#############################################################################################################
+
+class PriorityLock:
+    def __init__(self):
+        self._locked = False
+        self._waiters = []
+        self._sequence = itertools.count()
+
+    def locked(self):
+        return self._locked
+
+    async def acquire(self, priority = PRIORITY_NORMAL):
+        if not self._locked and not self._waiters:
+            self._locked = True
+            return True
+        waiter = (priority, next(self._sequence), asyncio.get_running_loop().create_future())
+        heapq.heappush(self._waiters, waiter)
+        try:
+            await waiter[2]
+        except asyncio.CancelledError:
+            if waiter[2].done() and not waiter[2].cancelled():
+                # Granted just as the waiter was cancelled: pass it on
+                self.release()
+            elif waiter in self._waiters:
+                self._waiters.remove(waiter)
+                heapq.heapify(self._waiters)
+            raise
+        return True
+
+    def release(self):
+        while self._waiters:
+            priority, sequence, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(True)
+                return
+        self._locked = False
+
+    def priority(self, priority):
+        return _PriorityContext(self, priority)
+
+    async def __aenter__(self):
+        await self.acquire()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.release()
+
+
+class _PriorityContext:
+    def __init__(self, lock, priority):
+        self._lock = lock
+        self._priority = priority
+
+    async def __aenter__(self):
+        await self._lock.acquire(self._priority)
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self._lock.release()
+
+
+# Connections shared by the inverters behind the same logger, keyed by (host, port, logger serial)
+_connections = {}
+
+
+def acquire_connection(host, port, serial, timeout, probe = None):
+    # Return the connection to the logger, shared with the other inverters behind it
+    key = (host, port, serial)
+    connection = _connections.get(key)
+    if connection is None:
+        connection = _connections[key] = LoggerConnection(host, port, serial, timeout, probe)
+    elif connection.users:
+        log.info(f"Sharing the connection to solarman data logger {host}:{port} with [{connection.users}] other inverter(s)")
+    connection.users += 1
+    return connection
+
+
+async def release_connection(connection):
+    # Close the connection once the last inverter behind the logger is gone
+    connection.users -= 1
+    if connection.users <= 0:
+        _connections.pop((connection.host, connection.port, connection.serial), None)
+        await connection.close()
+
+
+#############################################################################################################
+# A long-lived connection to a data logger.
+#  The connection is kept open between polls and probed when idle, and only re-established when the link
+#  is really dead. Reconnects after failed attempts back off exponentially with jitter.
+#  The lock serializes the requests sent over the connection, including the keep-alive probes. Requesters
+#  take it for one request (or one pipelined batch) at a time, and it is granted in FIFO order, so the
+#  inverters sharing a logger take turns on the RS485 bus instead of hitting it in parallel. Writes wait
+#  with a higher priority, so they go between two blocks of a poll instead of after the whole poll.
+#############################################################################################################
+
+class LoggerConnection:
+    def __init__(self, host, port, serial, timeout, probe = None):
+        self.host = host
+        self.port = port
+        self.serial = serial
+        self.timeout = timeout
+        # (slave id, register, function code) read to check an idle connection
+        self.probe = probe
+        self.lock = PriorityLock()
+        self.users = 0
+        self.connects = 0
+        self.drops = 0
+        # Seconds taken by the last successful connect
+        self.connect_time = None
+        # Whether the logger copes with several requests in flight; None until known
+        self.pipelining = None
+        self._client = None
+        self._failures = 0
+        self._next_attempt = 0
+        self._keepalive_task = None
+
+    @property
+    def connected(self):
+        return self._client is not None and self._client.connected
+
+    async def client(self):
+        if self.connected:
+            return self._client
+        if self._client is not None:
+            await self.drop('connection lost')
+
+        now = time.monotonic()
+        if now < self._next_attempt:
+            raise ConnectionError(f'Waiting [{self._next_attempt - now:.1f}] s before reconnecting to {self.host}:{self.port}')
+
+        log.info(f"Connecting to solarman data logger {self.host}:{self.port}")
+        client = V5Client(self.host, self.serial, port=self.port, timeout=self.timeout)
+        begin = time.perf_counter()
+        try:
+            await client.connect()
+        except Exception:
+            self._failures += 1
+            delay = min(BACKOFF_MAX, BACKOFF_INITIAL * 2 ** (self._failures - 1))
+            self._next_attempt = time.monotonic() + random.uniform(delay / 2, delay)
+            raise
+        self.connect_time = time.perf_counter() - begin
+        self._failures = 0
+        self._next_attempt = 0
+        self.connects += 1
+        self._client = client
+        if self.probe and self._keepalive_task is None:
+            self._keepalive_task = asyncio.create_task(self._keepalive())
+        return client
+
+    async def drop(self, reason, client = None):
+        # Drop the current client, unless it is no longer the given one (another inverter already reconnected)
+        if client is not None and client is not self._client:
+            return
+        client = self._client
+        if client is None:
+            return
+        self._client = None
+        self.drops += 1
+        log.info(f"Disconnecting from solarman data logger {self.host}:{self.port} ({reason})")
+        await client.disconnect()
+
+    async def close(self):
+        if self._keepalive_task:
+            self._keepalive_task.cancel()
+            self._keepalive_task = None
+        client = self._client
+        self._client = None
+        if client:
+            await client.disconnect()
+
+    async def _keepalive(self):
+        mb_slave_id, register, mb_fc = self.probe
+        while True:
+            await asyncio.sleep(KEEPALIVE_INTERVAL)
+            client = self._client
+            if client is None or time.monotonic() - client.last_received < KEEPALIVE_INTERVAL:
+                continue
+            async with self.lock:
+                if client is not self._client or not client.connected:
+                    continue
+                try:
+                    if mb_fc == 4:
+                        await client.read_input_registers(register, 1, mb_slave_id)
+                    else:
+                        await client.read_holding_registers(register, 1, mb_slave_id)
+                    log.debug(f"Keep-alive of {self.host}:{self.port} succeeded")
+                except Exception as e:
+                    log.debug(f"Keep-alive of {self.host}:{self.port} failed with exception [{type(e).__name__}: {e}]")
+                    if is_transport_error(e):
+                        await self.drop('keep-alive failed')
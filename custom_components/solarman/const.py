@@ -1,4 +1,5 @@
 from datetime import timedelta
+from functools import cache
 import os
 
 DOMAIN = 'solarman'
@@ -7,15 +8,21 @@ DEFAULT_PORT_INVERTER = 8899
 DEFAULT_INVERTER_MB_SLAVEID = 1
 DEFAULT_LOOKUP_FILE = 'deye_hybrid.yaml'
 
-LOOKUP_FILES = (sorted([f for f in os.listdir(os.path.dirname(__file__) + '/inverter_definitions') if f.endswith('.yaml')]))
+
+@cache
+def list_lookup_files():
+    # The definition files, listed once. Listing the folder is blocking I/O, to be done in the executor.
+    return sorted([f for f in os.listdir(os.path.dirname(__file__) + '/inverter_definitions') if f.endswith('.yaml')])
 
 
 MIN_TIME_BETWEEN_UPDATES = timedelta(seconds=15)
+DEFAULT_SCAN_INTERVAL = timedelta(seconds=30)
 
 CONF_INVERTER_HOST = 'inverter_host'
 CONF_INVERTER_PORT = 'inverter_port'
 CONF_INVERTER_SERIAL = 'inverter_serial'
 CONF_INVERTER_MB_SLAVEID = 'inverter_mb_slaveid'
 CONF_LOOKUP_FILE = 'lookup_file'
+CONF_HISTORY_SIZE = 'history_size'
 
 SENSOR_PREFIX = 'Solarman'
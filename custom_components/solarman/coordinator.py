@@ -0,0 +1,25 @@
+import logging
+
+from homeassistant.core import HomeAssistant
+from homeassistant.helpers.update_coordinator import DataUpdateCoordinator
+
+from .const import *
+from .solarman import Inverter
+
+_LOGGER = logging.getLogger(__name__)
+
+
+#############################################################################################################
+# Polls the inverter once per interval and hands the same result to all of its entities.
+#  A failed poll is not raised as UpdateFailed: the inverter reports it through an empty result and its
+#  status entities, so those stay available while the logger is unreachable.
+#############################################################################################################
+
+class InverterCoordinator(DataUpdateCoordinator):
+    def __init__(self, hass: HomeAssistant, inverter: Inverter, inverter_name, update_interval):
+        super().__init__(hass, _LOGGER, name=f'{DOMAIN} {inverter_name}', update_interval=update_interval)
+        self.inverter = inverter
+
+    async def _async_update_data(self):
+        await self.inverter.get_statistics()
+        return self.inverter.get_current_val()
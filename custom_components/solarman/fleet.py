@@ -0,0 +1,173 @@
+################################################################################
+#   Polling of a fleet of inverters without Home Assistant.
+#
+#   The inverters are listed in a YAML (or JSON) file and polled at their
+#   interval by the same Inverter objects as in Home Assistant. Each poll
+#   is written as one JSON line.
+#
+#   Usage, from the root of the repository:
+#     python -m custom_components.solarman.fleet fleet.yaml [-o polls.jsonl]
+#       [--concurrency 8] [--interval 30s] [--duration 1h]
+#
+###############################################################################
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+from datetime import datetime
+
+import yaml
+
+from .const import DEFAULT_PORT_INVERTER, DEFAULT_INVERTER_MB_SLAVEID, DEFAULT_LOOKUP_FILE
+from .solarman import Inverter, YAML_LOADER, parse_interval
+
+log = logging.getLogger(__name__)
+
+DEFAULT_INTERVAL = 30
+DEFAULT_CONCURRENCY = 8
+DEFINITIONS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'inverter_definitions', '')
+
+
+def load_fleet(path):
+    # Return the inverters of the fleet file, a list of mappings (or {'inverters': [...]}) with the keys
+    #  serial and host, and optionally name, port, mb_slaveid, lookup_file, path and interval.
+    with open(path) as f:
+        fleet = yaml.load(f, Loader=YAML_LOADER)
+    if isinstance(fleet, dict):
+        fleet = fleet.get('inverters', [])
+    inverters = []
+    for i, entry in enumerate(fleet):
+        if 'host' not in entry or 'serial' not in entry:
+            raise ValueError(f'Inverter [{i}] of {path} needs a host and a serial')
+        inverters.append({
+            'name': entry.get('name', f"{entry['host']}-{entry['serial']}-{entry.get('mb_slaveid', DEFAULT_INVERTER_MB_SLAVEID)}"),
+            'host': entry['host'],
+            'port': entry.get('port', DEFAULT_PORT_INVERTER),
+            'serial': entry['serial'],
+            'mb_slaveid': entry.get('mb_slaveid', DEFAULT_INVERTER_MB_SLAVEID),
+            'lookup_file': entry.get('lookup_file', DEFAULT_LOOKUP_FILE),
+            'path': entry.get('path', DEFINITIONS_PATH),
+            'interval': parse_interval(entry.get('interval')),
+        })
+    return inverters
+
+
+#############################################################################################################
+# Polls every inverter of the fleet at its interval.
+#  At most `concurrency` polls run at once, and at most one per data logger: the inverters behind a logger
+#  share its connection and would only wait for each other, so they queue for the logger (in FIFO order)
+#  before taking one of the slots, which are left to the polls that can run.
+#############################################################################################################
+
+class FleetPoller:
+    def __init__(self, inverters, output, concurrency = DEFAULT_CONCURRENCY, interval = DEFAULT_INTERVAL):
+        self._entries = inverters
+        self._output = output
+        self._slots = asyncio.Semaphore(concurrency)
+        self._loggers = {}
+        self._interval = interval
+        self._inverters = []
+        self.polls = 0
+        self.failures = 0
+        # Seconds run and CPU seconds used by the last run
+        self.elapsed = 0
+        self.cpu = 0
+
+    async def run(self, duration = None):
+        # Poll until cancelled, or for duration seconds
+        started = time.monotonic()
+        cpu = time.process_time()
+        self._inverters = [(entry, Inverter(entry['path'], entry['serial'], entry['host'], entry['port'], entry['mb_slaveid'], entry['lookup_file']))
+                           for entry in self._entries]
+        tasks = [asyncio.create_task(self._poll_loop(entry, inverter)) for entry, inverter in self._inverters]
+        try:
+            if duration is None:
+                await asyncio.gather(*tasks)
+            else:
+                done, pending = await asyncio.wait(tasks, timeout=duration, return_when=asyncio.FIRST_EXCEPTION)
+                # A poll loop only ends on an error, which is raised instead of being lost with the others
+                for task in done:
+                    task.result()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await asyncio.gather(*(inverter.close() for entry, inverter in self._inverters))
+            self.elapsed = time.monotonic() - started
+            self.cpu = time.process_time() - cpu
+
+    def summary(self):
+        elapsed = max(self.elapsed, 1e-9)
+        return (f'{len(self._entries)} inverters, {self.polls} polls ({self.failures} failed) in {self.elapsed:.1f} s: '
+                f'{self.polls / elapsed:.1f} polls/s, {self.cpu / max(self.polls, 1) * 1e3:.2f} ms CPU per poll, '
+                f'{self.cpu / elapsed * 100:.0f}% of one core')
+
+    async def _poll_loop(self, entry, inverter):
+        interval = entry['interval'] or self._interval
+        logger = self._loggers.setdefault((entry['host'], entry['port']), asyncio.Lock())
+        next_poll = time.monotonic()
+        while True:
+            delay = next_poll - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            next_poll += interval
+            async with logger:
+                async with self._slots:
+                    started = time.perf_counter()
+                    try:
+                        await inverter.get_statistics()
+                    except Exception as e:
+                        log.warning(f"Polling {entry['name']} failed with exception [{type(e).__name__}: {e}]")
+                    elapsed = time.perf_counter() - started
+            self._write(entry, inverter, elapsed)
+            # A poll that overran its interval is not made up for
+            next_poll = max(next_poll, time.monotonic())
+
+    def _write(self, entry, inverter, elapsed):
+        values = inverter.get_current_val() or {}
+        self.polls += 1
+        if inverter.status_connection != 'Connected':
+            self.failures += 1
+        record = {
+            'time': datetime.now().astimezone().isoformat(timespec='seconds'),
+            'name': entry['name'],
+            'serial': entry['serial'],
+            'mb_slaveid': entry['mb_slaveid'],
+            'connection': inverter.status_connection,
+            'poll_ms': round(elapsed * 1000, 1),
+            'values': values,
+        }
+        self._output.write(json.dumps(record, default=str) + '\n')
+        self._output.flush()
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(prog='python -m custom_components.solarman.fleet', description='Poll a fleet of inverters without Home Assistant')
+    arg_parser.add_argument('fleet', help='YAML or JSON file listing the inverters')
+    arg_parser.add_argument('-o', '--output', help='file to append the JSON lines to (default: stdout)')
+    arg_parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY, help='polls running at once')
+    arg_parser.add_argument('--interval', type=parse_interval, default=DEFAULT_INTERVAL, help='interval of the inverters without one, such as 30 or 1m')
+    arg_parser.add_argument('--duration', type=parse_interval, help='time to run, such as 600 or 1h (default: until interrupted)')
+    arg_parser.add_argument('-v', '--verbose', action='store_true')
+    args = arg_parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.WARNING, stream=sys.stderr)
+    inverters = load_fleet(args.fleet)
+    output = open(args.output, 'a') if args.output else sys.stdout
+    poller = FleetPoller(inverters, output, args.concurrency, args.interval)
+    try:
+        asyncio.run(poller.run(args.duration))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if output is not sys.stdout:
+            output.close()
+        print(poller.summary(), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
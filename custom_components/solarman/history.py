@@ -0,0 +1,134 @@
+import logging
+import mmap
+import os
+import struct
+from array import array
+
+log = logging.getLogger(__name__)
+
+HISTORY_MAGIC = b'SLMH'
+HISTORY_VERSION = 1
+# Registers a record holds unless a block of the inverter is longer; the most a logger returns for one request
+HISTORY_REGISTERS = 125
+# magic, version, registers per record, capacity, records written since the file was created
+HEADER = struct.Struct('<4sHHIQ')
+HEADER_SIZE = 32
+# time of the poll (seconds since the epoch), poll number, start register, register count, function code
+RECORD = struct.Struct('<dIHHH')
+
+
+#############################################################################################################
+# Ring buffer of the raw registers read from an inverter, in a memory-mapped file.
+#  Every block read is kept as one record of fixed size with the time and number of its poll, so the values
+#  of any period can be decoded again (with the current definition) until the records are overwritten.
+#  Writing a record only copies it into the mapping; the OS writes it back to the file.
+#############################################################################################################
+
+class RegisterHistory:
+    def __init__(self, path, capacity, registers = HISTORY_REGISTERS):
+        self.path = path
+        self.capacity = capacity
+        self.registers = registers
+        self._file = None
+        self._map = None
+        self.written = 0
+        # Records whose writing has begun, one more than written while a record is appended
+        self._begun = 0
+        self.poll = 0
+        self._open()
+
+    @property
+    def record_size(self):
+        return RECORD.size + 2 * self.registers
+
+    def _open(self):
+        kept = []
+        if os.path.exists(self.path):
+            with open(self.path, 'rb') as f:
+                header = f.read(HEADER_SIZE)
+            magic, version, registers, capacity, written = HEADER.unpack_from(header.ljust(HEADER_SIZE, b'\0'))
+            if magic != HISTORY_MAGIC or version != HISTORY_VERSION:
+                log.warning(f'{self.path} is not a register history, starting a new one')
+            elif registers >= self.registers and capacity == self.capacity:
+                self.registers = registers
+                self._map_file(written)
+                return
+            else:
+                # The records are copied to a file with the new capacity or record size
+                log.info(f'Resizing register history {self.path} from [{capacity}] records of [{registers}] registers to [{self.capacity}] records of [{max(registers, self.registers)}] registers')
+                old = RegisterHistory(self.path, capacity, registers)
+                try:
+                    kept = list(old.records())[-self.capacity:]
+                finally:
+                    old.close()
+                self.registers = max(registers, self.registers)
+        with open(self.path, 'wb') as f:
+            f.write(HEADER.pack(HISTORY_MAGIC, HISTORY_VERSION, self.registers, self.capacity, 0).ljust(HEADER_SIZE, b'\0'))
+        self._map_file(0)
+        for record in kept:
+            self.append(*record)
+        if kept:
+            self.poll = kept[-1][1]
+
+    def _map_file(self, written):
+        self._file = open(self.path, 'r+b')
+        size = HEADER_SIZE + self.capacity * self.record_size
+        if os.fstat(self._file.fileno()).st_size != size:
+            self._file.truncate(size)
+        self._map = mmap.mmap(self._file.fileno(), size)
+        self.written = written
+        self._begun = written
+        if written:
+            # Polls go on from the number of the last one kept
+            self.poll = RECORD.unpack_from(self._map, self._offset(written - 1))[1]
+
+    def _offset(self, index):
+        return HEADER_SIZE + (index % self.capacity) * self.record_size
+
+    def next_poll(self):
+        # Return the number of a new poll, for the records of its blocks
+        self.poll = (self.poll + 1) & 0xFFFFFFFF
+        return self.poll
+
+    def append(self, timestamp, poll, start, mb_fc, registers):
+        # Keep the registers read from start, overwriting the oldest record once the file is full
+        if len(registers) > self.registers:
+            log.debug(f'Not keeping registers [{start} - {start + len(registers) - 1}], longer than the [{self.registers}] of a record')
+            return
+        offset = self._offset(self.written)
+        # Readers skip the slot from now on, as it no longer holds the record they expect
+        self._begun = self.written + 1
+        RECORD.pack_into(self._map, offset, timestamp, poll, start, len(registers), mb_fc)
+        offset += RECORD.size
+        data = array('H', registers).tobytes()
+        self._map[offset:offset + len(data)] = data
+        self.written += 1
+        struct.pack_into('<Q', self._map, HEADER.size - 8, self.written)
+
+    def records(self, since = None, until = None):
+        # Yield (time, poll, start, function code, registers) of the records kept, oldest first.
+        #  Records may be appended meanwhile (from another thread); those overwritten, even partly, while read are skipped.
+        written = self.written
+        for index in range(max(0, written - self.capacity), written):
+            offset = self._offset(index)
+            timestamp, poll, start, length, mb_fc = RECORD.unpack_from(self._map, offset)
+            if since is not None and timestamp < since:
+                continue
+            if until is not None and timestamp > until:
+                # A clock set back may have kept later records before earlier ones, so all are read
+                continue
+            offset += RECORD.size
+            registers = array('H')
+            registers.frombytes(self._map[offset:offset + 2 * min(length, self.registers)])
+            if self._begun - index > self.capacity:
+                continue
+            yield timestamp, poll, start, mb_fc, registers
+
+    def close(self):
+        if self._map is not None:
+            self._map.flush()
+            self._map.close()
+            self._map = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -1,263 +1,496 @@
-import struct
+from array import array
 
-class ParameterParser:
-    def __init__(self, lookups):
-        self.result = {}
-        self._lookups = lookups 
-        return
+try:
+    import numpy
+except ImportError:
+    # The fields are then decoded one by one
+    numpy = None
 
-    def parse (self, rawData, start, length):
-        for i in self._lookups['parameters']:
-            for j in i['items']:
-                self.try_parse_field(rawData, j, start, length)        
-        return
+# Blocks with fewer numeric fields than this are decoded one field at a time, which is faster for them
+BATCH_MIN_FIELDS = 64
 
-    def get_result(self):
-        return self.result
 
+class InvalidateDataset(ValueError):
+    """A value failed a validation rule with invalidate_all."""
 
-    def try_parse_field (self, rawData, definition, start, length):
-        rule = definition['rule']
-        if rule == 1:
-            self.try_parse_unsigned(rawData,definition, start, length)
-        elif rule == 2:
-            self.try_parse_signed(rawData,definition, start, length)
-        elif rule == 3:
-            self.try_parse_unsigned(rawData,definition, start, length)
-        elif rule == 4:
-            self.try_parse_signed(rawData,definition, start, length)
-        elif rule == 5:
-            self.try_parse_ascii(rawData,definition, start, length)
-        elif rule == 6:
-            self.try_parse_bits(rawData,definition, start, length)
-        elif rule == 7:
-            self.try_parse_version(rawData,definition, start, length)
-        elif rule == 8:
-            self.try_parse_datetime(rawData,definition, start, length)
-        elif rule == 9:
-            self.try_parse_time(rawData,definition, start, length)
-        elif rule == 10:
-            self.try_parse_raw(rawData,definition, start, length)
-        return
-    
-    def do_validate(self, title, value, rule):
-        if 'min' in rule:           
-            if rule['min'] > value:
-                if 'invalidate_all' in rule:
-                    raise ValueError(f'Invalidate complete dataset ({title} ~ {value})')
-                return False
-
-        if 'max' in rule:                       
-            if rule['max'] < value:
-                if 'invalidate_all' in rule:
-                    raise ValueError(f'Invalidate complete dataset ({title} ~ {value})')
-                return False
-        
+
+def compile_block_plan (lookups, start, length):
+    # Return the decoders of the fields whose registers all fall inside the block [start, start + length),
+    # as (definition, offsets, decoder) tuples with the register offsets resolved against the block.
+    plan = BlockPlan()
+    for i in lookups['parameters']:
+        for j in i['items']:
+            offsets = tuple(r - start for r in j['registers'])
+            if all(0 <= o < length for o in offsets):
+                decoder = compile_field(j, offsets)
+                if decoder is not None:
+                    plan.append((j, offsets, decoder))
+    return plan
+
+
+class BlockPlan(list):
+    # The (definition, offsets, decoder) of the fields of a block, and its batch decoder once compiled
+
+    _batch = False
+
+    @property
+    def batch(self):
+        # decode(rawData, result) decoding the whole block, or None if numpy is missing or the block is too small
+        if self._batch is False:
+            self._batch = compile_batch(self)
+        return self._batch
+
+
+def compile_plan (lookups, requests = None):
+    # Build the parse plan for every request block (by default those of the definition), keyed by (start, length).
+    plan = {}
+    for request in (requests if requests is not None else lookups['requests']):
+        start = request['start']
+        length = request['end'] - start + 1
+        plan[(start, length)] = compile_block_plan(lookups, start, length)
+    return plan
+
+
+#############################################################################################################
+# Field decoders
+#  Each field of the definition is compiled once into a decoder(rawData, result) closure with everything it
+#  needs from the definition (offsets, scale, offset, mask, signedness, validation bounds) bound in.
+#############################################################################################################
+
+def compile_field (definition, offsets):
+    rule = definition['rule']
+    if rule == 1 or rule == 3:
+        return compile_number(definition, offsets, False)
+    elif rule == 2 or rule == 4:
+        return compile_number(definition, offsets, True)
+    elif rule == 5:
+        return compile_ascii(definition, offsets)
+    elif rule == 6 and 'lookup' in definition:
+        return compile_bitmask(definition, offsets)
+    elif rule == 6:
+        return compile_bits(definition, offsets)
+    elif rule == 7:
+        return compile_version(definition, offsets)
+    elif rule == 8:
+        return compile_datetime(definition, offsets)
+    elif rule == 9:
+        return compile_time(definition, offsets)
+    elif rule == 10:
+        return compile_raw(definition, offsets)
+    return None
+
+
+def compile_gather (offsets):
+    # Return a function combining the registers at offsets into one value, the first register being the least significant word.
+    if len(offsets) == 1:
+        o0, = offsets
+        return lambda rawData: rawData[o0] & 0xFFFF
+    if len(offsets) == 2:
+        o0, o1 = offsets
+        return lambda rawData: (rawData[o0] & 0xFFFF) | ((rawData[o1] & 0xFFFF) << 16)
+    shifted = tuple((o, 16 * i) for i, o in enumerate(offsets))
+    return lambda rawData: sum((rawData[o] & 0xFFFF) << shift for o, shift in shifted)
+
+
+def compile_validation (title, rule):
+    # Return a function telling whether the value is acceptable; raises ValueError when the whole dataset has to be invalidated.
+    if rule is None:
+        return None
+    minimum = rule['min'] if 'min' in rule else None
+    maximum = rule['max'] if 'max' in rule else None
+    invalidate_all = 'invalidate_all' in rule
+
+    def validate (value):
+        if (minimum is not None and minimum > value) or (maximum is not None and maximum < value):
+            if invalidate_all:
+                raise InvalidateDataset(f'Invalidate complete dataset ({title} ~ {value})')
+            return False
         return True
 
-    def try_parse_signed (self, rawData, definition, start, length):
-        title = definition['name']
-        scale = definition['scale'] if 'scale' in definition else 1
-        value = 0
-        found = True
-        shift = 0
-        maxint = 0
-        for r in definition['registers']:
-            index = r - start   # get the decimal value of the register'
-            if (index >= 0) and (index < length):
-                maxint <<= 16
-                maxint |= 0xFFFF
-                temp = rawData[index]
-                value += (temp & 0xFFFF) << shift
-                shift += 16
-            else:
-                found = False
-        if found:
-            if 'offset' in definition:
-                value = value - definition['offset']       
-                      
-            if value > maxint/2:
-                value = (value - maxint) * scale
-            else:
-                value = value * scale
-
-            if ('scale_division' in definition) and (definition['scale_division'] > 0):
-                value //= definition['scale_division']
-                
-            if 'validation' in definition:
-                if not self.do_validate(title, value, definition['validation']):
-                    return
-                
-            if self.is_integer_num (value):
-                self.result[title] = int(value)  
-            else:   
-                self.result[title] = value
+    return validate
 
-        return
-    
-    def try_parse_unsigned (self, rawData, definition, start, length):
-        title = definition['name']
-        scale = definition['scale'] if 'scale' in definition else 1
-        value = 0
-        found = True
-        shift = 0
-        for r in definition['registers']:
-            index = r - start   # get the decimal value of the register'
-            if (index >= 0) and (index < length):
-                temp = rawData[index]
-                value += (temp & 0xFFFF) << shift
-                shift += 16
-            else:
-                found = False
-        if found:
-            if 'mask' in definition:
-                mask = definition['mask']
+
+def compile_number (definition, offsets, signed):
+    title = definition['name']
+    gather = compile_gather(offsets)
+    scale = definition['scale'] if 'scale' in definition else 1
+    # The mask and lookup are only applied to unsigned values
+    mask = definition['mask'] if not signed and 'mask' in definition else None
+    offset = definition['offset'] if 'offset' in definition else None
+    division = definition['scale_division'] if ('scale_division' in definition) and (definition['scale_division'] > 0) else None
+    validate = compile_validation(title, definition['validation'] if 'validation' in definition else None)
+    maxint = (1 << (16 * len(offsets))) - 1
+
+    if not signed and 'lookup' in definition:
+        table = compile_lookup(definition['lookup'])
+
+        def decode_lookup (rawData, result):
+            value = gather(rawData)
+            if mask is not None:
                 value &= mask
+            result[title] = table.get(value, value)
 
-            if 'lookup' in definition:
-                self.result[title] = self.lookup_value (value, definition['lookup'])
-            else:
-                if 'offset' in definition:
-                    value = value - definition['offset']  
-                                   
-                value = value * scale
-
-                if ('scale_division' in definition) and (definition['scale_division'] > 0):
-                    value //= definition['scale_division']
-                
-                if 'validation' in definition:
-                    if not self.do_validate(title, value, definition['validation']):
-                        return
-
-                if self.is_integer_num (value):
-                    self.result[title] = int(value)  
-                else:   
-                    self.result[title] = value   
-        return
+        return decode_lookup
+
+    if mask is None and offset is None and division is None and validate is None:
+        # Plain register(s) times a scale, by far the most common definition
+        if signed:
+            half = maxint / 2
+
+            def decode_plain_signed (rawData, result):
+                value = gather(rawData)
+                if value > half:
+                    value -= maxint
+                result[title] = to_number(value * scale)
+
+            return decode_plain_signed
 
+        if isinstance(scale, int):
+            return lambda rawData, result: result.__setitem__(title, gather(rawData) * scale)
 
-    def lookup_value (self, value, options):
-        for o in options:
-            if (o['key'] == value):
-                return o['value']
-        return value
+        return lambda rawData, result: result.__setitem__(title, to_number(gather(rawData) * scale))
 
+    half = maxint / 2 if signed else None
 
-    def try_parse_ascii (self, rawData, definition, start, length):
-        title = definition['name']         
-        found = True
+    def decode (rawData, result):
+        value = gather(rawData)
+        if mask is not None:
+            value &= mask
+        if offset is not None:
+            value = value - offset
+        if half is not None and value > half:
+            value = value - maxint
+        value = value * scale
+        if division is not None:
+            value //= division
+        if validate is not None and not validate(value):
+            return
+        result[title] = to_number(value)
+
+    return decode
+
+
+def compile_ascii (definition, offsets):
+    title = definition['name']
+
+    def decode (rawData, result):
         value = ''
-        for r in definition['registers']:
-            index = r - start   # get the decimal value of the register'
-            if (index >= 0) and (index < length):
-                temp = rawData[index]
-                value = value + chr(temp >> 8) + chr(temp & 0xFF)
-            else:
-                found = False
-
-        if found:
-            self.result[title] = value
-        return  
-    
-    def try_parse_bits (self, rawData, definition, start, length):
-        title = definition['name']         
-        found = True
-        value = []
-        for r in definition['registers']:
-            index = r - start   # get the decimal value of the register'
-            if (index >= 0) and (index < length):
-                temp = rawData[index]
-                value.append(hex(temp))
-            else:
-                found = False
-
-        if found:
-            self.result[title] = value
-        return 
-
-    def try_parse_raw (self, rawData, definition, start, length):
-        title = definition['name']
-        found = True
-        value = []
-        for r in definition['registers']:
-            index = r - start   # get the decimal value of the register'
-            if (index >= 0) and (index < length):
-                temp = rawData[index]
-                value.append((temp))
-            else:
-                found = False
+        for index in offsets:
+            temp = rawData[index]
+            value = value + chr(temp >> 8) + chr(temp & 0xFF)
+        result[title] = value
 
-        if found:
-            self.result[title] = value
-        return
-    
-    def try_parse_version (self, rawData, definition, start, length):
-        title = definition['name']         
-        found = True
+    return decode
+
+
+def compile_bits (definition, offsets):
+    title = definition['name']
+    return lambda rawData, result: result.__setitem__(title, [hex(rawData[index]) for index in offsets])
+
+
+def compile_bitmask (definition, offsets):
+    # A fault or alarm word: the names of the bits set, each lookup key being the mask of a bit (or of several bits)
+    #  over the registers, the first register holding the lowest 16 bits. Bits set that no name covers are shown in hex.
+    title = definition['name']
+    gather = compile_gather(offsets)
+    mask = definition['mask'] if 'mask' in definition else None
+    bits = {}
+    masks = []
+    cleared = None
+    for o in definition['lookup']:
+        key = o['key']
+        if key == 0:
+            if cleared is None:
+                cleared = o['value']
+        elif key & (key - 1) == 0:
+            bits.setdefault(key, o['value'])
+        else:
+            masks.append((key, o['value']))
+    if cleared is None:
+        cleared = hex(0)
+    known = 0
+    for key in bits:
+        known |= key
+
+    def decode (rawData, result):
+        value = gather(rawData)
+        if mask is not None:
+            value &= mask
+        if not value:
+            result[title] = cleared
+            return
+        names = []
+        # The bits of a mask only count as named when all of them are set
+        covered = value & known
+        for k, v in masks:
+            if value & k == k:
+                names.append(v)
+                covered |= k
+        rest = value & known
+        while rest:
+            bit = rest & -rest
+            rest ^= bit
+            names.append(bits[bit])
+        unknown = value & ~covered
+        if unknown:
+            names.append(hex(unknown))
+        result[title] = ', '.join(names)
+
+    return decode
+
+
+def compile_raw (definition, offsets):
+    title = definition['name']
+    return lambda rawData, result: result.__setitem__(title, [rawData[index] for index in offsets])
+
+
+def compile_version (definition, offsets):
+    title = definition['name']
+
+    def decode (rawData, result):
         value = ''
-        for r in definition['registers']:
-            index = r - start   # get the decimal value of the register'
-            if (index >= 0) and (index < length):
-                temp = rawData[index]
-                value = value + str(temp >> 12) + "." +  str(temp >> 8 & 0x0F) + "." + str(temp >> 4 & 0x0F) + "." + str(temp & 0x0F)
-            else:
-                found = False
- 
-        if found:
-            self.result[title] = value
-        return
+        for index in offsets:
+            temp = rawData[index]
+            value = value + str(temp >> 12) + "." +  str(temp >> 8 & 0x0F) + "." + str(temp >> 4 & 0x0F) + "." + str(temp & 0x0F)
+        result[title] = value
+
+    return decode
 
-    def try_parse_datetime (self, rawData, definition, start, length):
-        title = definition['name']         
-        found = True
+
+def compile_datetime (definition, offsets):
+    title = definition['name']
+
+    def decode (rawData, result):
         value = ''
-        print("start: ", start)
-        for i,r in enumerate(definition['registers']):
-            index = r - start   # get the decimal value of the register'
-            print ("index: ",index)
-            if (index >= 0) and (index < length):
-                temp = rawData[index]
-                if(i==0):
-                    value = value + str(temp >> 8)  + "/" + str(temp & 0xFF) + "/"
-                elif (i==1):
-                    value = value + str(temp >> 8)  + " " + str(temp & 0xFF) + ":"
-                elif(i==2):
-                    value = value + str(temp >> 8)  + ":" + str(temp & 0xFF)
-                else:
-                    value = value + str(temp >> 8)  + str(temp & 0xFF)
+        for i,index in enumerate(offsets):
+            temp = rawData[index]
+            if(i==0):
+                value = value + str(temp >> 8)  + "/" + str(temp & 0xFF) + "/"
+            elif (i==1):
+                value = value + str(temp >> 8)  + " " + str(temp & 0xFF) + ":"
+            elif(i==2):
+                value = value + str(temp >> 8)  + ":" + str(temp & 0xFF)
             else:
-                found = False
- 
-        if found:
-            self.result[title] = value
-        return
+                value = value + str(temp >> 8)  + str(temp & 0xFF)
+        result[title] = value
 
-    def try_parse_time (self, rawData, definition, start, length):
-        title = definition['name']         
-        found = True
+    return decode
+
+
+def compile_time (definition, offsets):
+    title = definition['name']
+
+    def decode (rawData, result):
         value = ''
-        for r in definition['registers']:
-            index = r - start   # get the decimal value of the register'
-            if (index >= 0) and (index < length):
-                temp = rawData[index]
-                value = str("{:02d}".format(int(temp / 100))) + ":" + str("{:02d}".format(int(temp % 100)))
-            else:
-                found = False
+        for index in offsets:
+            temp = rawData[index]
+            value = str("{:02d}".format(int(temp / 100))) + ":" + str("{:02d}".format(int(temp % 100)))
+        result[title] = value
+
+    return decode
+
+
+#############################################################################################################
+# Batch decoder
+#  The numeric fields (rules 1 to 4) of one or two registers without a lookup are decoded together with numpy:
+#  grouped by width and signedness, their registers are gathered from one array of the block and the mask,
+#  offset, sign, scale, division and validation are applied to the whole group at once, in the same order
+#  and with the same float arithmetic as compile_number. The other fields keep their scalar decoder.
+#############################################################################################################
+
+def batchable (definition, offsets):
+    rule = definition['rule']
+    signed = rule == 2 or rule == 4
+    return (rule in (1, 2, 3, 4) and len(offsets) in (1, 2) and (signed or 'lookup' not in definition)
+            and not isinstance(definition.get('offset', 0), float))
+
+
+def compile_batch (fields):
+    if numpy is None:
+        return None
+    groups = {}
+    scalar = []
+    for definition, offsets, decode in fields:
+        if batchable(definition, offsets):
+            rule = definition['rule']
+            groups.setdefault((len(offsets), rule == 2 or rule == 4), []).append((definition, offsets))
+        else:
+            scalar.append(decode)
+    if sum(len(g) for g in groups.values()) < BATCH_MIN_FIELDS:
+        return None
+    decoders = [compile_group(width, signed, group) for (width, signed), group in groups.items()]
+
+    def decode (rawData, result):
+        registers = numpy.asarray(rawData, dtype=numpy.int64)
+        for decode_group in decoders:
+            decode_group(registers, result)
+        for decode_field in scalar:
+            decode_field(rawData, result)
+
+    return decode
 
-        if found:
-            self.result[title] = value
+
+def compile_group (width, signed, group):
+    titles = [d['name'] for d, o in group]
+    columns = [numpy.array([o[i] for d, o in group], dtype=numpy.intp) for i in range(width)]
+    masks = [d['mask'] if not signed and 'mask' in d else None for d, o in group]
+    mask = numpy.array([-1 if m is None else m for m in masks], dtype=numpy.int64) if any(m is not None for m in masks) else None
+    offsets = [d['offset'] if 'offset' in d else 0 for d, o in group]
+    offset = numpy.array(offsets, dtype=numpy.int64) if any(offsets) else None
+    scale = numpy.array([d['scale'] if 'scale' in d else 1 for d, o in group], dtype=numpy.float64)
+    divisions = [d['scale_division'] if 'scale_division' in d and d['scale_division'] > 0 else None for d, o in group]
+    division = numpy.array([1 if v is None else v for v in divisions], dtype=numpy.float64) if any(v is not None for v in divisions) else None
+    divided = numpy.array([v is not None for v in divisions])
+    rules = [d['validation'] if 'validation' in d else None for d, o in group]
+    validated = any(r is not None for r in rules)
+    minimum = numpy.array([r['min'] if r and 'min' in r else -numpy.inf for r in rules], dtype=numpy.float64)
+    maximum = numpy.array([r['max'] if r and 'max' in r else numpy.inf for r in rules], dtype=numpy.float64)
+    invalidate_all = numpy.array([r is not None and 'invalidate_all' in r for r in rules])
+    maxint = (1 << (16 * width)) - 1
+
+    def decode (registers, result):
+        value = registers[columns[0]]
+        if width == 2:
+            value = value | (registers[columns[1]] << 16)
+        if mask is not None:
+            value = value & mask
+        if offset is not None:
+            value = value - offset
+        if signed:
+            value = numpy.where(value > maxint / 2, value - maxint, value)
+        value = value * scale
+        if division is not None:
+            value = numpy.where(divided, value // division, value)
+        integral = (value == numpy.floor(value)).tolist()
+        values = value.tolist()
+        if validated:
+            failed = (value < minimum) | (value > maximum)
+            if failed.any():
+                invalid = failed & invalidate_all
+                if invalid.any():
+                    i = int(numpy.argmax(invalid))
+                    raise InvalidateDataset(f'Invalidate complete dataset ({titles[i]} ~ {to_number(values[i])})')
+                for title, v, is_integral, f in zip(titles, values, integral, failed.tolist()):
+                    if not f:
+                        result[title] = int(v) if is_integral else v
+                return
+        for title, v, is_integral in zip(titles, values, integral):
+            result[title] = int(v) if is_integral else v
+
+    return decode
+
+
+def compile_lookup (options):
+    # The first option of a key wins, as when the options were searched in order
+    table = {}
+    for o in options:
+        table.setdefault(o['key'], o['value'])
+    return table
+
+
+def to_number (value):
+    # Report integral values as int, as the entities always did
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+#############################################################################################################
+# The registers of one request block, kept from one poll to the next.
+#  The registers are copied into a buffer allocated once, and only the fields reading a register that changed
+#  since the last poll are decoded again; the values of the other fields are kept as they were.
+#############################################################################################################
+
+class RegisterSnapshot:
+    def __init__(self, fields, length):
+        # fields is the block plan, as returned by compile_block_plan
+        self.registers = array('H', bytes(2 * length))
+        self.values = {}
+        self._fields = fields
+        # Indexes of the fields reading each register of the block
+        self._readers = [[] for _ in range(length)]
+        for index, (definition, offsets, decode) in enumerate(fields):
+            for o in offsets:
+                self._readers[o].append(index)
+        self._valid = False
+
+    def invalidate(self):
+        # Decode every field on the next update
+        self._valid = False
+
+    def update(self, rawData):
+        # Return the values of the block after the poll that read rawData
+        registers = self.registers
+        if not self._valid or len(rawData) != len(registers):
+            return self._decode_all(rawData)
+        changed = set()
+        readers = self._readers
+        for o, value in enumerate(rawData):
+            if registers[o] != value:
+                registers[o] = value
+                changed.update(readers[o])
+        if len(changed) >= BATCH_MIN_FIELDS and self._fields.batch is not None:
+            # Decoding the whole block at once is cheaper than field by field
+            return self._decode_all(rawData)
+        if changed:
+            values = self.values
+            fields = self._fields
+            try:
+                for index in sorted(changed):
+                    definition, offsets, decode = fields[index]
+                    # A value failing its validation now must not keep the previous one
+                    values.pop(definition['name'], None)
+                    decode(registers, values)
+            except Exception:
+                self._valid = False
+                raise
+        return self.values
+
+    def _decode_all(self, rawData):
+        # The values are decoded into a new dict, so the previous values are left intact if decoding fails
+        values = {}
+        self._valid = False
+        if len(rawData) != len(self.registers):
+            # A short reply is decoded as it is, and not kept
+            for definition, offsets, decode in self._fields:
+                decode(rawData, values)
+            return values
+        self.registers[:] = array('H', rawData)
+        if self._fields.batch is not None:
+            self._fields.batch(self.registers, values)
+        else:
+            for definition, offsets, decode in self._fields:
+                decode(self.registers, values)
+        self.values = values
+        self._valid = True
+        return values
+
+
+class ParameterParser:
+    def __init__(self, lookups, plan = None):
+        self.result = {}
+        self._lookups = lookups
+        self._plan = plan if plan is not None else {}
+        return
+
+    def parse (self, rawData, start, length):
+        fields = self._plan.get((start, length))
+        if fields is None:
+            fields = self._plan[(start, length)] = compile_block_plan(self._lookups, start, length)
+        result = self.result
+        if fields.batch is not None and len(rawData) == length:
+            fields.batch(rawData, result)
+            return
+        for definition, offsets, decode in fields:
+            decode(rawData, result)
         return
- 
+
+    def get_result(self):
+        return self.result
+
     def get_sensors (self):
         result = []
         for i in self._lookups['parameters']:
             for j in i['items']:
                 result.append(j)
         return result
-    
-    def is_integer_num(self, n):
-        if isinstance(n, int):
-            return True
-        if isinstance(n, float):
-            return n.is_integer()
-        return False
@@ -0,0 +1,229 @@
+################################################################################
+#   Solarman V5 protocol on asyncio streams.
+#
+#   The V5 frame wraps a Modbus RTU frame addressed to the inverter behind the
+#   logger. Replies are matched to requests by the sequence number the logger
+#   echoes back, so nothing blocks while a request is in flight.
+#
+###############################################################################
+
+import asyncio
+import logging
+import struct
+import time
+
+log = logging.getLogger(__name__)
+
+V5_START = 0xA5
+V5_END = 0x15
+V5_HEADER_LENGTH = 11
+V5_TRAILER_LENGTH = 2
+
+CONTROL_REQUEST = 0x4510
+CONTROL_RESPONSE = 0x1510
+# Frames the logger sends on its own (handshake, data, info, heartbeat, report) and expects an answer to
+CONTROL_UNSOLICITED = (0x4110, 0x4210, 0x4310, 0x4710, 0x4810)
+CONTROL_UNSOLICITED_OFFSET = 0x3000
+
+# frame type, sensor type, total working time, power on time, offset time
+REQUEST_PAYLOAD_HEADER = struct.pack('<BHIII', 0x02, 0x0000, 0, 0, 0)
+# frame type, status, total working time, power on time, offset time
+RESPONSE_PAYLOAD_HEADER_LENGTH = 14
+
+DEFAULT_TIMEOUT = 15
+
+
+class V5FrameError(Exception):
+    """The V5 frame is malformed or does not belong to this client."""
+
+
+class ModbusError(Exception):
+    """The inverter replied with a Modbus exception or an invalid Modbus frame."""
+
+
+def crc16(data):
+    crc = 0xFFFF
+    for b in data:
+        crc ^= b
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0xA001 if crc & 1 else crc >> 1
+    return crc
+
+
+def with_crc(frame):
+    return frame + struct.pack('<H', crc16(frame))
+
+
+def v5_checksum(frame):
+    return sum(frame[1:-2]) & 0xFF
+
+
+def encode_v5_frame(control, sequence, serial, payload):
+    frame = bytearray(struct.pack('<BHHHI', V5_START, len(payload), control, sequence, serial))
+    frame += payload
+    frame += b'\x00\x15'
+    frame[-2] = v5_checksum(frame)
+    return bytes(frame)
+
+
+def decode_v5_frame(frame):
+    # Return (control, sequence, serial, payload) of a complete V5 frame
+    if len(frame) < V5_HEADER_LENGTH + V5_TRAILER_LENGTH or frame[0] != V5_START or frame[-1] != V5_END:
+        raise V5FrameError('V5 frame contains invalid start or end values')
+    start, length, control, sequence, serial = struct.unpack_from('<BHHHI', frame)
+    if length != len(frame) - V5_HEADER_LENGTH - V5_TRAILER_LENGTH:
+        raise V5FrameError('V5 frame contains invalid length')
+    if frame[-2] != v5_checksum(frame):
+        raise V5FrameError('V5 frame contains invalid checksum')
+    return control, sequence, serial, frame[V5_HEADER_LENGTH:-V5_TRAILER_LENGTH]
+
+
+def encode_read_request(slave_id, mb_fc, register_addr, quantity):
+    return with_crc(struct.pack('>BBHH', slave_id, mb_fc, register_addr, quantity))
+
+
+def encode_write_single_request(slave_id, register_addr, value):
+    return with_crc(struct.pack('>BBHH', slave_id, 0x06, register_addr, value))
+
+
+def encode_write_multiple_request(slave_id, register_addr, values):
+    return with_crc(struct.pack(f'>BBHHB{len(values)}H', slave_id, 0x10, register_addr, len(values), 2 * len(values), *values))
+
+
+def decode_modbus_response(frame, slave_id, mb_fc):
+    # Return the register values of a read response, or the (address, value/quantity) echo of a write response.
+    #  Some loggers pad the Modbus frame, so only the length implied by the function code is checked.
+    if len(frame) < 5:
+        raise V5FrameError('V5 frame does not contain a valid Modbus RTU frame')
+    if frame[1] == mb_fc | 0x80:
+        length = 5
+    elif mb_fc in (0x03, 0x04):
+        length = 5 + frame[2]
+    else:
+        length = 8
+    if len(frame) < length:
+        raise ModbusError('Modbus RTU frame is truncated')
+    frame = frame[:length]
+    if crc16(frame[:-2]) != struct.unpack_from('<H', frame, length - 2)[0]:
+        raise ModbusError('Modbus RTU frame contains invalid CRC')
+    if frame[0] != slave_id:
+        raise ModbusError(f'Modbus RTU frame is from slave [{frame[0]}] instead of [{slave_id}]')
+    if frame[1] == mb_fc | 0x80:
+        raise ModbusError(f'Modbus exception [{frame[2]}] for function code [{mb_fc}]')
+    if frame[1] != mb_fc:
+        raise ModbusError(f'Modbus RTU frame has function code [{frame[1]}] instead of [{mb_fc}]')
+    if mb_fc in (0x03, 0x04):
+        return list(struct.unpack_from(f'>{frame[2] // 2}H', frame, 3))
+    return list(struct.unpack_from('>HH', frame, 2))
+
+
+class V5Client:
+    def __init__(self, address, serial, port = 8899, mb_slave_id = 1, timeout = DEFAULT_TIMEOUT):
+        self.address = address
+        self.serial = serial
+        self.port = port
+        self.mb_slave_id = mb_slave_id
+        self.timeout = timeout
+        self._reader = None
+        self._writer = None
+        self._reader_task = None
+        self._pending = {}
+        # Time of the last frame received from the logger, and the bytes received over the connection
+        self.last_received = 0
+        self.bytes_received = 0
+        self._sequence = int(time.monotonic() * 1000) & 0xFF
+
+    @property
+    def connected(self):
+        return self._writer is not None and not self._writer.is_closing()
+
+    async def connect(self):
+        self._reader, self._writer = await asyncio.wait_for(asyncio.open_connection(self.address, self.port), self.timeout)
+        self.last_received = time.monotonic()
+        self._reader_task = asyncio.create_task(self._read_frames())
+
+    async def disconnect(self):
+        writer = self._writer
+        self._writer = None
+        if self._reader_task:
+            self._reader_task.cancel()
+            self._reader_task = None
+        self._fail_pending(ConnectionError('Disconnected'))
+        if writer:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except OSError:
+                pass
+
+    # The slave id of the inverter may be given per request, so that inverters sharing the logger share the client
+    async def read_holding_registers(self, register_addr, quantity, mb_slave_id = None):
+        return await self._send_receive(encode_read_request(mb_slave_id or self.mb_slave_id, 0x03, register_addr, quantity), mb_slave_id, 0x03)
+
+    async def read_input_registers(self, register_addr, quantity, mb_slave_id = None):
+        return await self._send_receive(encode_read_request(mb_slave_id or self.mb_slave_id, 0x04, register_addr, quantity), mb_slave_id, 0x04)
+
+    async def write_holding_register(self, register_addr, value, mb_slave_id = None):
+        return (await self._send_receive(encode_write_single_request(mb_slave_id or self.mb_slave_id, register_addr, value), mb_slave_id, 0x06))[1]
+
+    async def write_multiple_holding_registers(self, register_addr, values, mb_slave_id = None):
+        return (await self._send_receive(encode_write_multiple_request(mb_slave_id or self.mb_slave_id, register_addr, values), mb_slave_id, 0x10))[1]
+
+    def _next_sequence(self):
+        self._sequence = (self._sequence + 1) & 0xFF
+        return self._sequence
+
+    async def _send_receive(self, modbus_frame, mb_slave_id, mb_fc):
+        if not self.connected:
+            raise ConnectionError(f'Not connected to {self.address}:{self.port}')
+        sequence = self._next_sequence()
+        future = asyncio.get_running_loop().create_future()
+        self._pending[sequence] = future
+        try:
+            self._writer.write(encode_v5_frame(CONTROL_REQUEST, sequence, self.serial, REQUEST_PAYLOAD_HEADER + modbus_frame))
+            await self._writer.drain()
+            payload = await asyncio.wait_for(future, self.timeout)
+        finally:
+            self._pending.pop(sequence, None)
+        return decode_modbus_response(payload[RESPONSE_PAYLOAD_HEADER_LENGTH:], mb_slave_id or self.mb_slave_id, mb_fc)
+
+    async def _read_frame(self):
+        while (await self._reader.readexactly(1))[0] != V5_START:
+            pass
+        header = await self._reader.readexactly(2)
+        length = struct.unpack('<H', header)[0]
+        return bytes([V5_START]) + header + await self._reader.readexactly(length + V5_HEADER_LENGTH + V5_TRAILER_LENGTH - 3)
+
+    async def _read_frames(self):
+        try:
+            while True:
+                frame = await self._read_frame()
+                self.last_received = time.monotonic()
+                self.bytes_received += len(frame)
+                try:
+                    control, sequence, serial, payload = decode_v5_frame(frame)
+                except V5FrameError as e:
+                    log.debug(f'Discarding frame from {self.address}: {e}')
+                    continue
+                if serial != self.serial:
+                    log.debug(f'Discarding frame from {self.address} for logger serial [{serial}]')
+                elif control == CONTROL_RESPONSE:
+                    future = self._pending.get(sequence & 0xFF)
+                    if future and not future.done():
+                        future.set_result(payload)
+                elif control in CONTROL_UNSOLICITED and self._writer:
+                    self._writer.write(encode_v5_frame(control - CONTROL_UNSOLICITED_OFFSET, sequence, self.serial,
+                                                       struct.pack('<BBII', payload[0] if payload else 0, 0x01, int(time.time()), 0)))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log.debug(f'Connection to {self.address}:{self.port} lost [{type(e).__name__}: {e}]')
+            self._fail_pending(ConnectionError(f'Connection lost [{type(e).__name__}: {e}]'))
+            if self._writer:
+                self._writer.close()
+                self._writer = None
+
+    def _fail_pending(self, exception):
+        for future in self._pending.values():
+            if not future.done():
+                future.set_exception(exception)
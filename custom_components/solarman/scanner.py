@@ -1,43 +1,90 @@
-
+import asyncio
+import logging
 import socket
+import time
+
+log = logging.getLogger(__name__)
+
+DISCOVERY_PORT = 48899
+DISCOVERY_REQUEST = b"WIFIKIT-214028-READ"
+# Seconds to collect the replies of the loggers after the broadcast
+DISCOVERY_TIMEOUT = 1.0
+# Seconds for which the loggers found are remembered
+DISCOVERY_TTL = 300
+
+
+class DiscoveryProtocol(asyncio.DatagramProtocol):
+    def __init__(self, loggers):
+        self.loggers = loggers
+
+    def datagram_received(self, data, addr):
+        # The loggers reply with "ip address,mac address,serial number"
+        try:
+            a = data.decode().split(',')
+            if 3 == len(a):
+                self.loggers[a[1]] = {'ipaddress': a[0], 'mac': a[1], 'serial': int(a[2])}
+        except ValueError:
+            log.debug(f'Discarding discovery reply from {addr[0]}: {data!r}')
 
 
+#############################################################################################################
+# Finds the data loggers on the local network.
+#  A broadcast is answered by every logger; their replies are collected until the deadline. The result is
+#  remembered for a while and a scan in progress is shared, so inverters set up together cause one scan.
+#############################################################################################################
+
 class InverterScanner:
-    def __init__(self):
-        self._ipaddress = None
-        self._serial = None
-        self._mac = None
-
-    def _discover_inverters(self):    
-        request = "WIFIKIT-214028-READ"
-        address = ("<broadcast>", 48899)
+    def __init__(self, timeout = DISCOVERY_TIMEOUT, ttl = DISCOVERY_TTL):
+        self.timeout = timeout
+        self.ttl = ttl
+        self._loggers = []
+        self._scanned = None
+        self._scan = None
+
+    async def _discover_inverters(self):
+        loggers = {}
         try:
-            with socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP) as sock:
-                sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-                sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-                sock.settimeout(1.0)
-
-                sock.sendto(request.encode(), address)
-                
-                while True:
-                    try:
-                        data = sock.recv(1024)
-                        a = data.decode().split(',')
-                        if 3 == len(a):
-                            self._ipaddress = a[0]
-                            self._mac = a[1]
-                            self._serial = int(a[2])
-                    except socket.timout:
-                        break
-        except:                        
-            return None    
-            
-    def get_ipaddress(self):
-        if not self._ipaddress:
-            self._discover_inverters()
-        return self._ipaddress
-    
-    def get_serialno(self):
-        if not self._serial:
-            self._discover_inverters()
-        return self._serial    
+            transport, _ = await asyncio.get_running_loop().create_datagram_endpoint(
+                lambda: DiscoveryProtocol(loggers), local_addr=('0.0.0.0', 0), family=socket.AF_INET, allow_broadcast=True)
+        except OSError as e:
+            log.warning(f'Discovery of the data loggers failed with exception [{type(e).__name__}: {e}]')
+            return []
+        try:
+            transport.sendto(DISCOVERY_REQUEST, ('255.255.255.255', DISCOVERY_PORT))
+            await asyncio.sleep(self.timeout)
+        finally:
+            transport.close()
+        log.debug(f'Discovered [{len(loggers)}] data logger(s): {list(loggers.values())}')
+        if loggers:
+            # Nothing found is not remembered, so the next caller scans again
+            self._loggers = list(loggers.values())
+            self._scanned = time.monotonic()
+        return list(loggers.values())
+
+    async def discover(self):
+        # Return the loggers found, as dicts with ipaddress, mac and serial
+        if self._scanned is not None and time.monotonic() - self._scanned < self.ttl:
+            return self._loggers
+        scan = self._scan
+        if scan is None:
+            scan = self._scan = asyncio.create_task(self._discover_inverters())
+            scan.add_done_callback(lambda task: setattr(self, '_scan', None))
+        # One caller giving up must not cancel the scan of the others
+        return await asyncio.shield(scan)
+
+    async def get_ipaddress(self, serial = None):
+        # The address of the logger with the serial number, or of the first logger found without one
+        logger = self._find(await self.discover(), 'serial', serial)
+        return logger['ipaddress'] if logger else None
+
+    async def get_serialno(self, ipaddress = None):
+        # The serial number of the logger at the address, or of the first logger found without one
+        logger = self._find(await self.discover(), 'ipaddress', ipaddress)
+        return logger['serial'] if logger else None
+
+    def _find(self, loggers, key, value):
+        if value:
+            return next((l for l in loggers if l[key] == value), None)
+        if len(loggers) > 1:
+            log.warning(f'Found [{len(loggers)}] data loggers, using the first one: {loggers[0]}')
+        return loggers[0] if loggers else None
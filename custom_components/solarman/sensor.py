@@ -8,36 +8,40 @@
 ###############################################################################
 
 import logging
+import os
 import re
+import time
+from datetime import timedelta
 import voluptuous as vol
-from homeassistant.core import HomeAssistant
+from homeassistant.core import HomeAssistant, callback
 from homeassistant.config_entries import ConfigEntry
-from homeassistant.const import CONF_NAME, EntityCategory
-from homeassistant.helpers.entity import Entity
+from homeassistant.const import CONF_NAME, CONF_SCAN_INTERVAL, EVENT_HOMEASSISTANT_STOP, EntityCategory
 from homeassistant.helpers.entity_platform import AddEntitiesCallback
+from homeassistant.helpers.update_coordinator import CoordinatorEntity
 
 from .const import *
-from .solarman import Inverter
+from .solarman import Inverter, load_definition, resolve_lookup_file
+from .coordinator import InverterCoordinator
 from .scanner import InverterScanner
 from .services import *
 
 _LOGGER = logging.getLogger(__name__)
+# Shared by all the entries, so that entries set up together wait for one scan
 _inverter_scanner = InverterScanner()
 
 
-def _do_setup_platform(hass: HomeAssistant, config, async_add_entities : AddEntitiesCallback):
+async def _do_setup_platform(hass: HomeAssistant, config, async_add_entities : AddEntitiesCallback):
     _LOGGER.debug(f'sensor.py:async_setup_platform: {config}') 
+    started = time.perf_counter()
     
     inverter_name = config.get(CONF_NAME)
     inverter_host = config.get(CONF_INVERTER_HOST)
-    if inverter_host == "0.0.0.0":
-        inverter_host = _inverter_scanner.get_ipaddress()
-        
-   
     inverter_port = config.get(CONF_INVERTER_PORT)
     inverter_sn = config.get(CONF_INVERTER_SERIAL)
+    if inverter_host == "0.0.0.0":
+        inverter_host = await _inverter_scanner.get_ipaddress(inverter_sn)
     if inverter_sn == 0:
-        inverter_sn = _inverter_scanner.get_serialno()
+        inverter_sn = await _inverter_scanner.get_serialno(inverter_host)
 
     inverter_mb_slaveid = config.get(CONF_INVERTER_MB_SLAVEID)
     if not inverter_mb_slaveid:
@@ -51,27 +55,57 @@ def _do_setup_platform(hass: HomeAssistant, config, async_add_entities : AddEnti
     if inverter_sn is None:
         raise vol.Invalid('configuration parameter [inverter_serial] does not have a value')
 
-    inverter = Inverter(path, inverter_sn, inverter_host, inverter_port, inverter_mb_slaveid, lookup_file)
+    # The definition file is read and compiled in the executor, not to block the event loop
+    definition = await hass.async_add_executor_job(load_definition, path + resolve_lookup_file(lookup_file))
+    # The entities polled at scan_interval and the inverter throttled the polls to MIN_TIME_BETWEEN_UPDATES
+    scan_interval = max(config.get(CONF_SCAN_INTERVAL, DEFAULT_SCAN_INTERVAL), MIN_TIME_BETWEEN_UPDATES)
+    inverter = Inverter(path, inverter_sn, inverter_host, inverter_port, inverter_mb_slaveid, lookup_file, definition, scan_interval.total_seconds())
+    history_size = config.get(CONF_HISTORY_SIZE)
+    if history_size:
+        history_path = hass.config.path(DOMAIN, f'{inverter_sn}_{inverter_mb_slaveid}.history')
+        def open_history():
+            os.makedirs(os.path.dirname(history_path), exist_ok=True)
+            inverter.open_history(history_path, history_size)
+        await hass.async_add_executor_job(open_history)
+    update_interval = scan_interval
+    # Blocks of the definition may ask to be queried more often; the others stay at the scan interval
+    if inverter.poll_interval:
+        update_interval = min(update_interval, timedelta(seconds=inverter.poll_interval))
+    coordinator = InverterCoordinator(hass, inverter, inverter_name, update_interval)
     #  Prepare the sensor entities.
     hass_sensors = []
     for sensor in inverter.get_sensors():
         try:
             if "isstr" in sensor:
-                hass_sensors.append(SolarmanSensorText(inverter_name, inverter, sensor, inverter_sn))
+                hass_sensors.append(SolarmanSensorText(coordinator, inverter_name, sensor, inverter_sn))
             else:
-                hass_sensors.append(SolarmanSensor(inverter_name, inverter, sensor, inverter_sn))
+                hass_sensors.append(SolarmanSensor(coordinator, inverter_name, sensor, inverter_sn))
         except BaseException as ex:
             _LOGGER.error(f'Config error {ex} {sensor}')
             raise
-    hass_sensors.append(SolarmanStatusDiag(inverter_name, inverter, "status_lastUpdate", inverter_sn))
-    hass_sensors.append(SolarmanStatusDiag(inverter_name, inverter, "status_connection", inverter_sn))
+    hass_sensors.append(SolarmanStatusDiag(coordinator, inverter_name, "status_lastUpdate", inverter_sn))
+    hass_sensors.append(SolarmanStatusDiag(coordinator, inverter_name, "status_connection", inverter_sn))
+    hass_sensors.append(SolarmanStatusDiag(coordinator, inverter_name, "status_connects", inverter_sn))
+    hass_sensors.append(SolarmanStatusDiag(coordinator, inverter_name, "status_drops", inverter_sn))
+    # Timings of the last poll, to tell a slow network or bus from a slow host
+    hass_sensors.append(SolarmanStatusDiag(coordinator, inverter_name, "status_poll_time", inverter_sn, "ms"))
+    hass_sensors.append(SolarmanStatusDiag(coordinator, inverter_name, "status_connect_time", inverter_sn, "ms"))
+    hass_sensors.append(SolarmanStatusDiag(coordinator, inverter_name, "status_query_time", inverter_sn, "ms"))
+    hass_sensors.append(SolarmanStatusDiag(coordinator, inverter_name, "status_parse_time", inverter_sn, "ms"))
+    hass_sensors.append(SolarmanStatusDiag(coordinator, inverter_name, "status_retries", inverter_sn))
+    hass_sensors.append(SolarmanStatusDiag(coordinator, inverter_name, "status_bytes_received", inverter_sn, "B"))
 
     _LOGGER.debug(f'sensor.py:_do_setup_platform: async_add_entities')
     _LOGGER.debug(hass_sensors)
 
     async_add_entities(hass_sensors)
-    # Register the services with home assistant.
+    # Register the services with home assistant, and the inverter for the service calls to its device
+    register_inverter(hass, inverter, inverter_sn)
     register_services (hass)
+    # The first poll feeds the entities just added, later ones are scheduled by the coordinator
+    hass.async_create_task(coordinator.async_refresh())
+    _LOGGER.debug(f'sensor.py:_do_setup_platform: [{len(hass_sensors)}] entities of {inverter_name} set up in [{(time.perf_counter() - started) * 1000:.1f}] ms')
+    return inverter
 
 
     
@@ -81,12 +115,22 @@ def _do_setup_platform(hass: HomeAssistant, config, async_add_entities : AddEnti
 # Set-up from configuration.yaml
 async def async_setup_platform(hass: HomeAssistant, config, async_add_entities : AddEntitiesCallback, discovery_info=None):
     _LOGGER.debug(f'sensor.py:async_setup_platform: {config}') 
-    _do_setup_platform(hass, config, async_add_entities)
+    inverter = await _do_setup_platform(hass, config, async_add_entities)
+
+    async def async_close(event):
+        unregister_inverter(hass, inverter)
+        await inverter.close()
+
+    hass.bus.async_listen_once(EVENT_HOMEASSISTANT_STOP, async_close)
        
 # Set-up from the entries in config-flow
 async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry, async_add_entities: AddEntitiesCallback):
     _LOGGER.debug(f'sensor.py:async_setup_entry: {entry.options}') 
-    _do_setup_platform(hass, entry.options, async_add_entities)
+    inverter = await _do_setup_platform(hass, entry.options, async_add_entities)
+    hass.data[DOMAIN][entry.entry_id] = inverter
+    # Close the connection kept open to the logger
+    entry.async_on_unload(inverter.close)
+    entry.async_on_unload(lambda: unregister_inverter(hass, inverter))
 
 
 #############################################################################################################
@@ -123,18 +167,23 @@ class SolarmanSensor():
 
 #############################################################################################################
 # This is the entity seen by Home Assistant.
-#  It derives from the Entity class in HA and is suited for status values.
+#  It derives from the CoordinatorEntity class in HA and is suited for status values.
+#  The coordinator of the inverter updates all its entities at once after each poll.
 #############################################################################################################
 
-class SolarmanStatus(SolarmanSensor, Entity):
-    def __init__(self, inverter_name, inverter, field_name, sn):
-        super().__init__(sn, inverter_name, inverter.lookup_file)
+class SolarmanStatus(SolarmanSensor, CoordinatorEntity):
+    def __init__(self, coordinator, inverter_name, field_name, sn):
+        super().__init__(sn, inverter_name, coordinator.inverter.lookup_file)
+        CoordinatorEntity.__init__(self, coordinator)
         self._inverter_name = inverter_name
-        self.inverter = inverter
+        self.inverter = coordinator.inverter
         self._field_name = field_name
         self.p_state = None
         self.p_icon = 'mdi:magnify'
         self._sn = sn
+        # Changes of a numeric state smaller than this are not written
+        self._deadband = None
+        self._written = False
         return
 
     @property
@@ -161,17 +210,44 @@ class SolarmanStatus(SolarmanSensor, Entity):
         #  Return the inverter of the sensor. """
         return self.inverter
 
-    def update(self):
-        self.p_state = getattr(self.inverter, self._field_name, None)
+    def _changed(self, old, new):
+        if self._deadband and isinstance(old, (int, float)) and isinstance(new, (int, float)):
+            return abs(new - old) >= self._deadband
+        return old != new
+
+    def _write_state(self, state):
+        # Only write a state that differs from the last one written, so unchanged values do not reach the recorder
+        if self._written and not self._changed(self.p_state, state):
+            return
+        self.p_state = state
+        self._written = True
+        self.async_write_ha_state()
+
+    @callback
+    def _handle_coordinator_update(self):
+        self._write_state(getattr(self.inverter, self._field_name, None))
 
 #############################################################################################################
 # This is the the same of SolarmanStatus, but it has EntityCategory setup to Diagnostic.
 #############################################################################################################
 
 class SolarmanStatusDiag(SolarmanStatus):
-    def __init__(self, inverter_name, inverter, field_name, sn):
-        super().__init__(inverter_name, inverter, field_name, sn)
+    def __init__(self, coordinator, inverter_name, field_name, sn, uom = None):
+        super().__init__(coordinator, inverter_name, field_name, sn)
         self._attr_entity_category = EntityCategory.DIAGNOSTIC
+        self.uom = uom
+
+    @property
+    def unit_of_measurement(self):
+        return self.uom
+
+    @property
+    def extra_state_attributes(self):
+        attributes = super().extra_state_attributes
+        details = self.inverter.get_status_attributes(self._field_name)
+        if details:
+            attributes = {**attributes, **details}
+        return attributes
 
 #############################################################################################################
 #  Entity displaying a text field read from the inverter
@@ -179,30 +255,32 @@ class SolarmanStatusDiag(SolarmanStatus):
 #############################################################################################################
 
 class SolarmanSensorText(SolarmanStatus):
-    def __init__(self, inverter_name, inverter, sensor, sn):
-        SolarmanStatus.__init__(self,inverter_name, inverter, sensor['name'], sn)
+    def __init__(self, coordinator, inverter_name, sensor, sn):
+        SolarmanStatus.__init__(self, coordinator, inverter_name, sensor['name'], sn)
         if 'icon' in sensor:
             self.p_icon = sensor['icon']
         else:
             self.p_icon = ''
+        if 'deadband' in sensor:
+            self._deadband = sensor['deadband']
         return
 
 
-    def update(self):
+    @callback
+    def _handle_coordinator_update(self):
     #  Update this sensor using the data.
-    #  Get the latest data and use it to update our sensor state.
-    #  Retrieve the sensor data from actual interface
-        self.inverter.update()
-
-        val = self.inverter.get_current_val()
+    #  Get the latest data polled by the coordinator and use it to update our sensor state.
+        val = self.coordinator.data
+        state = self.p_state
         if val is not None:
             if self._field_name in val:
-                self.p_state = val[self._field_name]
+                state = val[self._field_name]
             else:
                 uom = getattr(self, 'uom', None)
                 if uom and (re.match("\S+", uom)):
-                    self.p_state = None
+                    state = None
                 _LOGGER.debug(f'No value recorded for {self._field_name}')
+        self._write_state(state)
 
 
 #############################################################################################################
@@ -211,8 +289,8 @@ class SolarmanSensorText(SolarmanStatus):
 #############################################################################################################
 
 class SolarmanSensor(SolarmanSensorText):
-    def __init__(self, inverter_name, inverter, sensor, sn):
-        SolarmanSensorText.__init__(self, inverter_name, inverter, sensor, sn)
+    def __init__(self, coordinator, inverter_name, sensor, sn):
+        SolarmanSensorText.__init__(self, coordinator, inverter_name, sensor, sn)
         self._device_class = sensor['class']
         if 'state_class' in sensor:
             self._state_class = sensor['state_class']
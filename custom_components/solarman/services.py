@@ -1,7 +1,7 @@
 from homeassistant.core import HomeAssistant, SupportsResponse
-from homeassistant.helpers import config_validation as cv, entity_registry, entity
-from homeassistant.helpers.entity_component import EntityComponent
+from homeassistant.helpers import config_validation as cv, device_registry
 from homeassistant.exceptions import ServiceValidationError
+from homeassistant.util import dt as dt_util
 import voluptuous as vol
 from .const import *
 from .solarman import Inverter
@@ -13,11 +13,20 @@ SERVICE_READ_HOLDING_REGISTER            = 'read_holding_register'
 SERVICE_READ_MULTIPLE_HOLDING_REGISTERS  = 'read_multiple_holding_registers'
 SERVICE_WRITE_HOLDING_REGISTER           = 'write_holding_register'
 SERVICE_WRITE_MULTIPLE_HOLDING_REGISTERS = 'write_multiple_holding_registers'
+SERVICE_WRITE_REGISTERS                  = 'write_registers'
+SERVICE_READ_FIELDS                      = 'read_fields'
+SERVICE_READ_HISTORY                     = 'read_history'
 PARAM_DEVICE   = 'device'
 PARAM_REGISTER = 'register'
 PARAM_COUNT    = 'count'
 PARAM_VALUE    = 'value'
 PARAM_VALUES   = 'values'
+PARAM_REGISTERS = 'registers'
+PARAM_VERIFY   = 'verify'
+PARAM_FIELDS   = 'fields'
+PARAM_MAX_AGE  = 'max_age'
+PARAM_START    = 'start'
+PARAM_END      = 'end'
 
 
 # Register the services one can invoke on the inverter.
@@ -55,32 +64,90 @@ SERVICE_WRITE_MULTIPLE_REGISTERS_SCHEMA = vol.Schema(
     }
 )
 
-def register_services (hass: HomeAssistant ):
+SERVICE_WRITE_REGISTERS_SCHEMA = vol.Schema(
+    {
+        vol.Required(PARAM_DEVICE): vol.All(vol.Coerce(str)),
+        vol.Required(PARAM_REGISTERS): vol.All(dict, vol.Length(min=1), {
+            vol.All(vol.Coerce(int), vol.Range(min=0, max=65535)): vol.All(vol.Coerce(int), vol.Range(min=0, max=65535))
+        }),
+        vol.Optional(PARAM_VERIFY, default=False): cv.boolean,
+    }
+)
 
-    def getInverter(device_id):
-        inverter: Inverter | None
-        entity_comp: EntityComponent[entity.Entity] | None       
-        registry = entity_registry.async_get(hass)
-        entries = entity_registry.async_entries_for_device(registry, device_id)
-        for entity_reg in entries:
-            entity_id = entity_reg.entity_id
-            domain = entity_id.partition(".")[0]
-            entity_comp = hass.data.get("entity_components", {}).get(domain)
-            if entity_comp is None:
-                log.info(f'read_holding_register: Component for {entity_id} not loaded')
-                continue
-
-            if (entity_obj := entity_comp.get_entity(entity_id)) is None:
-                log.info(f'read_holding_register: Entity {entity_id} not found')
-                continue
-
-            if (inverter := entity_obj.inverter) is None:
-                log.info(f'read_holding_register: Entity {entity_id} has no inverter')
-                continue
-
-            break
+SERVICE_READ_FIELDS_SCHEMA = vol.Schema(
+    {
+        vol.Required(PARAM_DEVICE): vol.All(vol.Coerce(str)),
+        vol.Required(PARAM_FIELDS): vol.All(cv.ensure_list, vol.Length(min=1), [cv.string]),
+        vol.Optional(PARAM_MAX_AGE): vol.All(vol.Coerce(float), vol.Range(min=0)),
+    }
+)
+
+SERVICE_READ_HISTORY_SCHEMA = vol.Schema(
+    {
+        vol.Required(PARAM_DEVICE): vol.All(vol.Coerce(str)),
+        vol.Required(PARAM_START): cv.datetime,
+        vol.Optional(PARAM_END): cv.datetime,
+    }
+)
+
+
+# The inverters set up, in hass.data[DOMAIN]: by the identifier of their device (the serial number of the
+# logger, shared by the inverters behind it, in the order they were set up), and by the id of their device
+# in the device registry once a service call has looked it up
+DATA_INVERTERS = 'inverters'
+DATA_DEVICES   = 'devices'
+DATA_SERVICES  = 'services_registered'
+
+
+def _data(hass: HomeAssistant):
+    data = hass.data.setdefault(DOMAIN, {})
+    data.setdefault(DATA_INVERTERS, {})
+    data.setdefault(DATA_DEVICES, {})
+    return data
+
+
+def register_inverter(hass: HomeAssistant, inverter: Inverter, sn):
+    inverters = _data(hass)[DATA_INVERTERS].setdefault(str(sn), [])
+    if inverter not in inverters:
+        inverters.append(inverter)
+
+
+def unregister_inverter(hass: HomeAssistant, inverter: Inverter):
+    # The devices of the inverter are looked up again, and find the other inverters behind the logger if any
+    data = _data(hass)
+    for key, inverters in list(data[DATA_INVERTERS].items()):
+        if inverter in inverters:
+            inverters.remove(inverter)
+            if not inverters:
+                del data[DATA_INVERTERS][key]
+    for key in [k for k, v in data[DATA_DEVICES].items() if v is inverter]:
+        del data[DATA_DEVICES][key]
 
+
+def get_inverter(hass: HomeAssistant, device_id) -> Inverter | None:
+    data = _data(hass)
+    if (inverter := data[DATA_DEVICES].get(device_id)) is not None:
         return inverter
+    if (device := device_registry.async_get(hass).async_get(device_id)) is None:
+        log.info(f'Device {device_id} not found')
+        return None
+    for domain, identifier in device.identifiers:
+        if domain == DOMAIN and (inverters := data[DATA_INVERTERS].get(str(identifier))):
+            inverter = data[DATA_DEVICES][device_id] = inverters[0]
+            return inverter
+    log.info(f'Device {device_id} has no inverter')
+    return None
+
+
+def register_services (hass: HomeAssistant ):
+    # The services are shared by all the inverters, and registered with the first one
+    data = _data(hass)
+    if data.get(DATA_SERVICES):
+        return
+    data[DATA_SERVICES] = True
+
+    def getInverter(device_id):
+        return get_inverter(hass, device_id)
 
 
     async def read_holding_register(call) -> int:
@@ -92,7 +159,7 @@ def register_services (hass: HomeAssistant ):
             )
         
         try:
-            response = inverter.service_read_holding_register( register=call.data.get(PARAM_REGISTER) )
+            response = await inverter.service_read_holding_register( register=call.data.get(PARAM_REGISTER) )
         except Exception as e:
             raise ServiceValidationError(
                 e,
@@ -112,7 +179,7 @@ def register_services (hass: HomeAssistant ):
             )
         
         try:
-            response = inverter.service_read_multiple_holding_registers( 
+            response = await inverter.service_read_multiple_holding_registers( 
                 register=call.data.get(PARAM_REGISTER),
                  count=call.data.get(PARAM_COUNT) )
         except Exception as e:
@@ -138,7 +205,7 @@ def register_services (hass: HomeAssistant ):
             )
 
         try:
-            inverter.service_write_holding_register(
+            await inverter.service_write_holding_register(
                 register=call.data.get(PARAM_REGISTER), 
                 value=call.data.get(PARAM_VALUE))
         except Exception as e:
@@ -160,7 +227,7 @@ def register_services (hass: HomeAssistant ):
             )
 
         try:
-            inverter.service_write_multiple_holding_registers(
+            await inverter.service_write_multiple_holding_registers(
                 register=call.data.get(PARAM_REGISTER),
                 values=call.data.get(PARAM_VALUES))
         except Exception as e:
@@ -172,6 +239,71 @@ def register_services (hass: HomeAssistant ):
         
         return
 
+    async def write_registers(call) -> dict:
+        log.debug(f'write_registers: call={call}')
+        if (inverter := getInverter(call.data.get(PARAM_DEVICE))) is None:
+            raise ServiceValidationError(
+                "No communication interface for device found",
+                translation_domain=DOMAIN,
+                translation_key="no_interface_found",
+            )
+
+        try:
+            result = await inverter.service_write_registers(
+                values=call.data.get(PARAM_REGISTERS),
+                verify=call.data.get(PARAM_VERIFY))
+        except Exception as e:
+            raise ServiceValidationError(
+                e,
+                translation_domain=DOMAIN,
+                translation_key="call_failed"
+            )
+
+        return result
+
+    async def read_fields(call) -> dict:
+        if (inverter := getInverter(call.data.get(PARAM_DEVICE))) is None:
+            raise ServiceValidationError(
+                "No communication interface for device found",
+                translation_domain=DOMAIN,
+                translation_key="no_interface_found"
+            )
+
+        try:
+            result = await inverter.service_read_fields(
+                names=call.data.get(PARAM_FIELDS),
+                max_age=call.data.get(PARAM_MAX_AGE))
+        except Exception as e:
+            raise ServiceValidationError(
+                e,
+                translation_domain=DOMAIN,
+                translation_key="call_failed"
+            )
+
+        return result
+
+    async def read_history(call) -> dict:
+        if (inverter := getInverter(call.data.get(PARAM_DEVICE))) is None:
+            raise ServiceValidationError(
+                "No communication interface for device found",
+                translation_domain=DOMAIN,
+                translation_key="no_interface_found"
+            )
+
+        end = call.data.get(PARAM_END)
+        try:
+            polls = await inverter.read_history(
+                since=dt_util.as_utc(call.data.get(PARAM_START)).timestamp(),
+                until=dt_util.as_utc(end).timestamp() if end else None)
+        except Exception as e:
+            raise ServiceValidationError(
+                e,
+                translation_domain=DOMAIN,
+                translation_key="call_failed"
+            )
+
+        return {'polls': [{'time': dt_util.as_local(dt_util.utc_from_timestamp(t)).isoformat(), 'values': values} for t, values in polls]}
+
     hass.services.async_register(
         DOMAIN, SERVICE_READ_HOLDING_REGISTER, read_holding_register, schema=SERVICE_READ_REGISTER_SCHEMA, supports_response=SupportsResponse.OPTIONAL
     )
@@ -187,4 +319,16 @@ def register_services (hass: HomeAssistant ):
     hass.services.async_register(
         DOMAIN, SERVICE_WRITE_MULTIPLE_HOLDING_REGISTERS, write_multiple_holding_registers, schema=SERVICE_WRITE_MULTIPLE_REGISTERS_SCHEMA
     )
+
+    hass.services.async_register(
+        DOMAIN, SERVICE_WRITE_REGISTERS, write_registers, schema=SERVICE_WRITE_REGISTERS_SCHEMA, supports_response=SupportsResponse.OPTIONAL
+    )
+
+    hass.services.async_register(
+        DOMAIN, SERVICE_READ_FIELDS, read_fields, schema=SERVICE_READ_FIELDS_SCHEMA, supports_response=SupportsResponse.ONLY
+    )
+
+    hass.services.async_register(
+        DOMAIN, SERVICE_READ_HISTORY, read_history, schema=SERVICE_READ_HISTORY_SCHEMA, supports_response=SupportsResponse.ONLY
+    )
     return
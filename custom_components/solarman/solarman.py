@@ -1,21 +1,151 @@
-import socket
-import threading
+import asyncio
+import os
+import re
+import time
 import yaml
 import logging
-import struct
-from homeassistant.util import Throttle
 from datetime import datetime
-from .parser import ParameterParser
+from .parser import ParameterParser, RegisterSnapshot, InvalidateDataset, compile_plan
+from .connection import acquire_connection, release_connection, is_transport_error, PRIORITY_WRITE
+from .writes import WriteQueue, DEFAULT_WRITE_INTERVAL
+from .history import RegisterHistory, HISTORY_REGISTERS
 from .const import *
-from pysolarmanv5 import PySolarmanV5
 
 
 log = logging.getLogger(__name__)
 
 QUERY_RETRY_ATTEMPTS = 2
+QUERY_TIMEOUT = 15
+
+PLANNER_MAX_REGISTERS = 125
+PLANNER_MAX_GAP = 32
+
+# Values of a block that can no longer be queried are kept for this many seconds, or twice its interval if longer
+DEFAULT_MAX_AGE = 120
+
+# A block is queried when it is due within this many seconds, so that polls arriving slightly early do not skip it
+SCHEDULE_SLACK = 1
+
+INTERVAL_UNITS = {'': 1, 's': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+# The C loader of libyaml is much faster, when PyYAML was built with it
+YAML_LOADER = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+
+def parse_interval(value):
+    # Return the number of seconds of an interval given as a number of seconds or as a string such as '5s', '10m' or '1h'
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return value
+    match = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([smhd]?)\s*', str(value))
+    if not match:
+        raise ValueError(f'Invalid interval [{value}]')
+    return float(match.group(1)) * INTERVAL_UNITS[match.group(2)]
+
+
+def plan_requests(parameter_definition, max_registers = PLANNER_MAX_REGISTERS, max_gap = PLANNER_MAX_GAP):
+    # Build the smallest set of reads covering the registers of every parameter.
+    #  A parameter is never split across reads; its function code is taken from the hand-written request
+    #  that contains it, or from the first hand-written request if none does. Groups with an interval
+    #  are planned separately so that their reads carry the interval of the group.
+    hand_written = parameter_definition['requests']
+    default_fc = hand_written[0]['mb_functioncode'] if hand_written else 0x03
+    spans = {}
+    for i in parameter_definition['parameters']:
+        interval = i.get('interval')
+        for j in i['items']:
+            if not j['registers']:
+                continue
+            low = min(j['registers'])
+            high = max(j['registers'])
+            if high - low + 1 > max_registers:
+                log.warning(f"Parameter [{j['name']}] spans more than [{max_registers}] registers and is left out of the planned requests")
+                continue
+            mb_fc = next((r['mb_functioncode'] for r in hand_written if r['start'] <= low and high <= r['end']), default_fc)
+            spans.setdefault((mb_fc, interval), []).append((low, high))
+
+    requests = []
+    for (mb_fc, interval), ranges in spans.items():
+        ranges.sort()
+        start, end = ranges[0]
+        blocks = []
+        for low, high in ranges[1:]:
+            if low - end - 1 <= max_gap and max(end, high) - start + 1 <= max_registers:
+                end = max(end, high)
+            else:
+                blocks.append((start, end))
+                start, end = low, high
+        blocks.append((start, end))
+        for start, end in blocks:
+            request = {'start': start, 'end': end, 'mb_functioncode': mb_fc}
+            if interval is not None:
+                request['interval'] = interval
+            requests.append(request)
+    return requests
+
+
+# Registers written by one Modbus function 16 frame
+WRITE_MAX_REGISTERS = 123
+
+
+def group_registers(values, max_registers = WRITE_MAX_REGISTERS):
+    # Split a {register: value} map into runs of consecutive registers, as (first register, [values]).
+    #  Registers in between are never written, so a gap always starts a new run.
+    runs = []
+    for register in sorted(values):
+        if runs and register == runs[-1][0] + len(runs[-1][1]) and len(runs[-1][1]) < max_registers:
+            runs[-1][1].append(values[register])
+        else:
+            runs.append((register, [values[register]]))
+    return runs
+
+
+# Definitions loaded so far, keyed by file path, as (mtime, definition, requests, parse plan)
+_definitions = {}
+
+
+def load_definition(path):
+    # Return (definition, requests, parse plan) of a definition file, shared by all the inverters using it.
+    #  The file is loaded again when it was modified since. The definition and the plan must not be modified.
+    mtime = os.stat(path).st_mtime
+    cached = _definitions.get(path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1:]
+    with open(path) as f:
+        definition = yaml.load(f, Loader=YAML_LOADER)
+    requests = definition['requests']
+    if 'request_planner' in definition:
+        requests = planned_requests(os.path.basename(path), definition, definition['request_planner'] or {})
+    cached = _definitions[path] = (mtime, definition, requests, compile_plan(definition, requests))
+    return cached[1:]
+
+
+def planned_requests(name, parameter_definition, options):
+    hand_written = parameter_definition['requests']
+    planned = plan_requests(parameter_definition,
+                            options.get('max_registers', PLANNER_MAX_REGISTERS),
+                            options.get('max_gap', PLANNER_MAX_GAP))
+    for request in planned:
+        log.debug(f"Planned request [{request['start']} - {request['end']}] with function code [{request['mb_functioncode']}]")
+    hand_written_count = sum(r['end'] - r['start'] + 1 for r in hand_written)
+    planned_count = sum(r['end'] - r['start'] + 1 for r in planned)
+    log.info(f"{name}: planned [{len(planned)}] requests for [{planned_count}] registers instead of [{len(hand_written)}] requests for [{hand_written_count}] registers, saving [{hand_written_count - planned_count}] registers and [{len(hand_written) - len(planned)}] requests per poll")
+    return planned
+
+
+def resolve_lookup_file(lookup_file):
+    # The definition file used for lookup_file, which older configurations may leave empty
+    if not lookup_file or lookup_file == 'parameters.yaml':
+        return 'deye_hybrid.yaml'
+    return lookup_file
+
 
 class Inverter:
-    def __init__(self, path, serial, host, port, mb_slaveid, lookup_file):
+    def __init__(self, path, serial, host, port, mb_slaveid, lookup_file, definition = None, scan_interval = None):
+        # definition is the result of load_definition for the lookup file, when it was loaded beforehand
+        #  (in the executor, as loading it is blocking I/O). scan_interval is the seconds between the queries
+        #  of the blocks without an interval of their own.
         self._modbus = None
         self._serial = serial
         self.path = path
@@ -25,176 +155,513 @@ class Inverter:
         self._current_val = None
         self._status_connection = -1
         self.status_lastUpdate = "N/A"
-        self.lookup_file = lookup_file
-        self.lock = threading.Lock()
+        self.lookup_file = resolve_lookup_file(lookup_file)
+
+        if definition is None:
+            definition = load_definition(self.path + self.lookup_file)
+        self.parameter_definition, self._requests, self._parse_plan = definition
+        # Blocks without an interval are queried every scan_interval, or on every poll without one
+        self._declared_intervals = [parse_interval(r.get('interval')) for r in self._requests]
+        self._intervals = [i or scan_interval or 0 for i in self._declared_intervals]
+        self._max_ages = [parse_interval(r.get('max_age')) or max(DEFAULT_MAX_AGE, 2 * i) for r, i in zip(self._requests, self._intervals)]
+        self._next_query = [0] * len(self._requests)
+        self._block_values = [{} for r in self._requests]
+        self._block_updated = [None] * len(self._requests)
+        # The registers last read for each block, so that only the fields whose registers changed are decoded
+        self._snapshots = [RegisterSnapshot(self._parse_plan[(r['start'], r['end'] - r['start'] + 1)], r['end'] - r['start'] + 1) for r in self._requests]
+        # Number of requests sent before the first reply arrives; 1 queries the blocks one after another
+        self._pipeline_depth = max(1, int(self.parameter_definition.get('pipeline_depth', 1)))
 
-        if not self.lookup_file or lookup_file == 'parameters.yaml':
-            self.lookup_file = 'deye_hybrid.yaml'
+        # The first block is read to check the connection when idle
+        probe = (self._mb_slaveid, self._requests[0]['start'], self._requests[0]['mb_functioncode']) if self._requests else None
+        # Inverters behind the same logger share its connection, whose lock serializes their requests
+        self._connection = acquire_connection(self._host, self._port, self._serial, QUERY_TIMEOUT, probe)
+        self.lock = asyncio.Lock()
+        # Writes are coalesced and spaced out by the queue
+        self._writes = WriteQueue(self.write_register, parse_interval(self.parameter_definition.get('write_interval', DEFAULT_WRITE_INTERVAL)))
+        # Timings of the poll in progress, and those of the last poll
+        self._timings = None
+        self._last_timings = None
+        # Ring buffer of the registers read, if open_history was called, and (time, number) of the poll in progress
+        self._history = None
+        self._history_poll = None
 
-        with open(self.path + self.lookup_file) as f:
-            self.parameter_definition = yaml.full_load(f)
+    @property
+    def poll_interval(self):
+        # The shortest interval declared by a block, if any
+        intervals = [i for i in self._declared_intervals if i]
+        return min(intervals) if intervals else None
 
     @property
     def status_connection(self):
         return 'Connected' if self._status_connection == 1 else 'Diconnected'
 
+    @property
+    def status_connects(self):
+        return self._connection.connects
+
+    @property
+    def status_drops(self):
+        return self._connection.drops
+
+    # Timings of the last poll, in milliseconds
+    @property
+    def status_poll_time(self):
+        return self._last_timings['poll'] if self._last_timings else None
+
+    @property
+    def status_connect_time(self):
+        # Of the last connect to the logger, which may be older than the last poll
+        connect_time = self._connection.connect_time
+        return round(connect_time * 1000, 1) if connect_time is not None else None
+
+    @property
+    def status_query_time(self):
+        return round(sum(self._last_timings['blocks'].values()), 1) if self._last_timings else None
+
+    @property
+    def status_parse_time(self):
+        return self._last_timings['parse'] if self._last_timings else None
+
+    @property
+    def status_retries(self):
+        return self._last_timings['retries'] if self._last_timings else None
+
+    @property
+    def status_bytes_received(self):
+        return self._last_timings['bytes'] if self._last_timings else None
+
+    def get_status_attributes(self, field_name):
+        # The round trip of each block of the last poll is shown along with the total
+        if field_name == 'status_query_time' and self._last_timings:
+            return self._last_timings['blocks']
+        return None
+
     def is_connected_to_server(self):
-        return self._modbus != None
+        return self._connection.connected
 
-    def connect_to_server(self):
-        if self._modbus:
-            return self._modbus
-        log.info(f"Connecting to solarman data logger {self._host}:{self._port}")
-        self._modbus = PySolarmanV5(self._host, self._serial, port=self._port, mb_slave_id=self._mb_slaveid, logger=None, auto_reconnect=True, socket_timeout=15)
+    async def connect_to_server(self):
+        timings = self._timings
+        if timings is not None and not self._connection.connected:
+            begin = time.perf_counter()
+            self._modbus = await self._connection.client()
+            timings['connect'] = round((time.perf_counter() - begin) * 1000, 1)
+        else:
+            self._modbus = await self._connection.client()
+        if timings is not None:
+            # Bytes received so far by each client used during the poll
+            timings['clients'].setdefault(self._modbus, self._modbus.bytes_received)
+        return self._modbus
 
-    def disconnect_from_server(self):
-        if self._modbus:
-            try:
-                log.info(f"Disconnecting from solarman data logger {self._host}:{self._port}")
-                self._modbus.disconnect()
-            finally:
-                self._modbus = None
+    async def disconnect_from_server(self, reason = 'request failed'):
+        client = self._modbus
+        self._modbus = None
+        if client is not None:
+            await self._connection.drop(reason, client)
 
-    def send_request(self, params, start, end, mb_fc):
+    async def close(self):
+        await self._writes.close()
+        self._modbus = None
+        await release_connection(self._connection)
+        if self._history is not None:
+            history = self._history
+            self._history = None
+            self._history_poll = None
+            await asyncio.get_running_loop().run_in_executor(None, history.close)
+
+    def open_history(self, path, capacity):
+        # Keep the registers of the last capacity blocks read in the file. Opening it does blocking I/O.
+        registers = max([HISTORY_REGISTERS] + [r['end'] - r['start'] + 1 for r in self._requests])
+        self._history = RegisterHistory(path, capacity, registers)
+        log.debug(f"Keeping the registers read in {path}, [{self._history.written}] records so far")
+
+    async def send_request(self, snapshot, start, end, mb_fc):
+        # Return the values of the block, decoded from the reply into its snapshot
         length = end - start + 1
+        begin = time.perf_counter()
         match mb_fc:
             case 3:
-                response  = self._modbus.read_holding_registers(register_addr=start, quantity=length)
+                response  = await self._modbus.read_holding_registers(register_addr=start, quantity=length, mb_slave_id=self._mb_slaveid)
             case 4:
-                response  = self._modbus.read_input_registers(register_addr=start, quantity=length)
-        params.parse(response, start, length)        
+                response  = await self._modbus.read_input_registers(register_addr=start, quantity=length, mb_slave_id=self._mb_slaveid)
+        received = time.perf_counter()
+        if self._history_poll is not None:
+            self._history.append(*self._history_poll, start, mb_fc, response)
+        # The parse time is that of decoding alone, without keeping the registers in the history
+        parsing = time.perf_counter()
+        values = snapshot.update(response)
+        if self._timings is not None:
+            self._timings['blocks'][f'{start}-{end}'] = round((received - begin) * 1000, 1)
+            self._timings['parse'] += time.perf_counter() - parsing
+        return values
 
 
-    @Throttle (MIN_TIME_BETWEEN_UPDATES)
-    def update (self):
-        self.get_statistics()
-        return
+    async def query_block(self, i, level):
+        request = self._requests[i]
+        start = request['start']
+        end = request['end']
+        mb_fc = request['mb_functioncode']
+        log.debug(f"Querying [{start} - {end}]...")
 
+        attempts_left = QUERY_RETRY_ATTEMPTS
+        while True:
+            attempts_left -= 1
+            try:
+                async with self._connection.lock:
+                    await self.connect_to_server()
+                    values = await self.send_request(self._snapshots[i], start, end, mb_fc)
+                log.debug(f"Querying [{start} - {end}] succeeded")
+                return values
+            except Exception as e:
+                log.log(level, f"Querying [{start} - {end}] failed with exception [{type(e).__name__}: {e}]")
+                # Only a broken link is worth a new connection; the logger reports Modbus and frame errors on a healthy one
+                if is_transport_error(e):
+                    await self.disconnect_from_server()
+                if attempts_left <= 0:
+                    raise
+                if self._timings is not None:
+                    self._timings['retries'] += 1
+                log.log(level, f"Querying [{start} - {end}] failed, [{attempts_left}] retry attempts left")
 
-    def get_statistics(self):
-        result = 1
-        params = ParameterParser(self.parameter_definition)
-        requests = self.parameter_definition['requests']
-        log.debug(f"Starting to query for [{len(requests)}] ranges...")
+    async def query_blocks_pipelined(self, due, level):
+        # Send the requests of the due blocks without waiting for the replies, which the client matches by sequence number.
+        #  Returns the values or the exception of each block; failed blocks are queried again one by one.
+        log.debug(f"Querying [{len(due)}] ranges, [{self._pipeline_depth}] at a time...")
+        in_flight = asyncio.Semaphore(self._pipeline_depth)
+
+        async def query(i):
+            request = self._requests[i]
+            async with in_flight:
+                return await self.send_request(self._snapshots[i], request['start'], request['end'], request['mb_functioncode'])
 
-        with self.lock:
+        async with self._connection.lock:
             try:
-                isConnected = self._status_connection == 1
-                for request in requests:
-                    start = request['start']
-                    end = request['end']
-                    mb_fc = request['mb_functioncode']
-                    log.debug(f"Querying [{start} - {end}]...")
-
-                    attempts_left = QUERY_RETRY_ATTEMPTS
-                    while attempts_left > 0:
-                        attempts_left -= 1
-                        try:
-                            self.connect_to_server()
-                            self.send_request(params, start, end, mb_fc)
-                            result = 1
-                        except Exception as e:
-                            result = 0
-                            log.log((logging.WARNING if isConnected else logging.DEBUG), f"Querying [{start} - {end}] failed with exception [{type(e).__name__}: {e}]")
-                            self.disconnect_from_server()
-                        if result == 0:
-                            log.log((logging.WARNING if isConnected else logging.DEBUG), f"Querying [{start} - {end}] failed, [{attempts_left}] retry attempts left")
-                        else:
-                            log.debug(f"Querying [{start} - {end}] succeeded")
-                            break
-                    if result == 0:
-                        log.log((logging.WARNING if isConnected else logging.DEBUG), f"Querying registers [{start} - {end}] failed, aborting.")
-                        break
+                await self.connect_to_server()
+            except Exception:
+                return {}
+            results = await asyncio.gather(*(query(i) for i in due), return_exceptions=True)
+        for i, result in zip(due, results):
+            if isinstance(result, Exception):
+                log.debug(f"Pipelined query [{self._requests[i]['start']} - {self._requests[i]['end']}] failed with exception [{type(result).__name__}: {result}]")
+        return dict(zip(due, results))
 
-                if result == 1:
-                    log.debug(f"All queries succeeded, exposing updated values.")
-                    self.status_lastUpdate = datetime.now().strftime("%m/%d/%Y, %H:%M:%S")
-                    self._status_connection = 1
-                    self._current_val = params.get_result()
-                else:
-                    self._status_connection = 0
+    async def get_statistics(self):
+        requests = self._requests
+        now = time.monotonic()
+        due = [i for i in range(len(requests)) if self._next_query[i] <= now + SCHEDULE_SLACK]
+        succeeded = 0
+        transport_failed = False
+        log.debug(f"Starting to query for [{len(due)}] of [{len(requests)}] ranges...")
+
+        async with self.lock:
+            self._timings = {'begin': time.perf_counter(), 'connect': None, 'blocks': {}, 'retries': 0, 'parse': 0.0, 'clients': {}}
+            if self._history is not None:
+                self._history_poll = (time.time(), self._history.next_poll())
+            level = logging.WARNING if self._status_connection == 1 else logging.DEBUG
+            pipelined = {}
+            recovered = 0
+            if self._pipeline_depth > 1 and len(due) > 1 and self._connection.pipelining is not False:
+                pipelined = await self.query_blocks_pipelined(due, level)
+            for i in due:
+                request = requests[i]
+                try:
+                    values = pipelined.get(i)
+                    if isinstance(values, InvalidateDataset):
+                        raise values
+                    if values is None or isinstance(values, Exception):
+                        if i in pipelined:
+                            self._timings['retries'] += 1
+                        values = await self.query_block(i, level)
+                        if i in pipelined:
+                            recovered += 1
+                except InvalidateDataset as e:
+                    log.log(level, f"Querying registers [{request['start']} - {request['end']}] returned invalid data, discarding all values.")
                     # Clear cached previous results to not report stale and incorrect data
-                    self._current_val = {}
-                    self.disconnect_from_server()
-            except Exception as e:
-                log.warning(f"Querying inverter {self._serial} at {self._host}:{self._port} failed on connection start with exception [{type(e).__name__}: {e}]")
-                self._status_connection = 0
-                # Clear cached previous results to not report stale and incorrect data
+                    self.clear_values()
+                    self.finish_timings(len(due), 0)
+                    return
+                except Exception as e:
+                    log.log(level, f"Querying registers [{request['start']} - {request['end']}] failed, keeping its values for up to [{self._max_ages[i]}] s.")
+                    if is_transport_error(e):
+                        # The remaining blocks stay due for the next poll
+                        transport_failed = True
+                        break
+                    continue
+                succeeded += 1
+                self._block_values[i] = values
+                self._block_updated[i] = now
+                self._next_query[i] = now + self._intervals[i]
+
+            # Drop the values of blocks that failed for longer than they may be kept
+            for i, updated in enumerate(self._block_updated):
+                if updated is not None and now - updated > self._max_ages[i]:
+                    log.debug(f"Values of registers [{requests[i]['start']} - {requests[i]['end']}] expired.")
+                    self._block_values[i] = {}
+                    self._block_updated[i] = None
+
+            # Remember for the logger whether it copes with pipelined requests
+            if pipelined:
+                if recovered:
+                    log.info(f"Data logger {self._host}:{self._port} failed pipelined requests that succeeded one by one, no longer pipelining.")
+                    self._connection.pipelining = False
+                elif not any(isinstance(r, Exception) for r in pipelined.values()):
+                    self._connection.pipelining = True
+
+            # Merged into the same dict on every poll
+            if self._current_val is None:
                 self._current_val = {}
-                self.disconnect_from_server()
+            self._current_val.clear()
+            for values in self._block_values:
+                self._current_val.update(values)
+            if succeeded:
+                self.status_lastUpdate = datetime.now().strftime("%m/%d/%Y, %H:%M:%S")
+            self._status_connection = 0 if transport_failed else 1
+            log.debug(f"[{succeeded}] of [{len(due)}] queries succeeded, exposing updated values.")
+            self.finish_timings(len(due), succeeded)
+
+    def finish_timings(self, queried, succeeded):
+        # Keep the timings of the poll for the status entities and log them as a structured record
+        timings = self._timings
+        self._timings = None
+        self._history_poll = None
+        record = {
+            'inverter': self._serial,
+            'queried': queried,
+            'succeeded': succeeded,
+            'poll': round((time.perf_counter() - timings['begin']) * 1000, 1),
+            'connect': timings['connect'],
+            'blocks': timings['blocks'],
+            'retries': timings['retries'],
+            'bytes': sum(client.bytes_received - before for client, before in timings['clients'].items()),
+            'parse': round(timings['parse'] * 1000, 3),
+        }
+        self._last_timings = record
+        log.debug(f"Poll timings {record}", extra={'solarman_poll': record})
+
+    def clear_values(self):
+        # Forget every block, so all of them are queried again on the next poll
+        self._current_val = {}
+        self._block_values = [{} for r in self._requests]
+        self._block_updated = [None] * len(self._requests)
+        self._next_query = [0] * len(self._requests)
+        for snapshot in self._snapshots:
+            snapshot.invalidate()
 
     def get_current_val(self):
         return self._current_val
 
+    async def read_history(self, since = None, until = None):
+        # Return [(time, values)] of the polls kept between since and until (seconds since the epoch), decoded
+        #  with the definition file as it is now, so a fixed definition also fixes the values read before.
+        if self._history is None:
+            raise ValueError(f'No register history is kept for inverter {self._serial}')
+        # Reading the records may fault pages of the file in, so it is done in the executor with the decoding
+        return await asyncio.get_running_loop().run_in_executor(None, self.decode_history, self._history.records(since, until))
+
+    def decode_history(self, records):
+        definition, requests, plan = load_definition(self.path + self.lookup_file)
+        # The shared plan must not be modified; blocks it lacks are compiled into the copy
+        plan = dict(plan)
+        polls = []
+        params = None
+        poll = None
+        for timestamp, number, start, mb_fc, registers in records:
+            if number != poll:
+                if params is not None:
+                    polls.append((poll_time, params.get_result()))
+                params = ParameterParser(definition, plan)
+                poll = number
+                poll_time = timestamp
+            if params is None:
+                continue
+            try:
+                params.parse(registers, start, len(registers))
+            except InvalidateDataset:
+                log.debug(f"Registers [{start} - {start + len(registers) - 1}] of the poll at [{timestamp}] are invalid, discarding the poll.")
+                params = None
+        if params is not None:
+            polls.append((poll_time, params.get_result()))
+        return polls
+
     def get_sensors(self):
         params = ParameterParser(self.parameter_definition)
         return params.get_sensors ()
 
     # Service calls
-    def service_read_holding_register(self, register):
+    async def service_read_holding_register(self, register):
         log.debug(f'Service Call: read_holding_register : [{register}]')
 
-        with self.lock:
+        async with self._connection.lock:
             try:
-                wasConnected = self.is_connected_to_server()
-                self.connect_to_server()
-                response = self._modbus.read_holding_registers(register, 1)
+                await self.connect_to_server()
+                response = await self._modbus.read_holding_registers(register, 1, self._mb_slaveid)
                 log.info(f'Service Call: read_holding_registers : [{register}] value [{response}]')
-                if (not wasConnected):
-                    self.disconnect_from_server()
             except Exception as e:
                 log.warning(f"Service Call: read_holding_registers : [{register}] failed with exception [{type(e).__name__}: {e}]")
-                self.disconnect_from_server()
+                if is_transport_error(e):
+                    await self.disconnect_from_server()
                 raise e
                
         return response
 
-    def service_read_multiple_holding_registers(self, register, count):
+    async def service_read_multiple_holding_registers(self, register, count):
         log.debug(f'Service Call: read_holding_register : [{register}], count : {count}')
 
-        with self.lock:
+        async with self._connection.lock:
             try:
-                wasConnected = self.is_connected_to_server()
-                self.connect_to_server()
-                response = self._modbus.read_holding_registers(register, count)
+                await self.connect_to_server()
+                response = await self._modbus.read_holding_registers(register, count, self._mb_slaveid)
                 log.info(f'Service Call: read_holding_registers : [{register}] value [{response}]')
-                if (not wasConnected):
-                    self.disconnect_from_server()
             except Exception as e:
                 log.warning(f"Service Call: read_holding_registers : [{register}] failed with exception [{type(e).__name__}: {e}]")
-                self.disconnect_from_server()
+                if is_transport_error(e):
+                    await self.disconnect_from_server()
                 raise e
                
         return response
 
 
-    def service_write_holding_register(self, register, value):
-        log.debug(f'Service Call: write_holding_register : [{register}], value : [{value}]')
-        with self.lock:
+    async def write_register(self, register, values, multiple = False):
+        # Write the values from register on, ahead of the blocks of a poll waiting for the connection.
+        #  Called by the write queue; a single value is written with function code 6 unless multiple.
+        async with self._connection.lock.priority(PRIORITY_WRITE):
             try:
-                wasConnected = self.is_connected_to_server()
-                self.connect_to_server()
-                self._modbus.write_holding_register(register, value)
-                if (not wasConnected):
-                    self.disconnect_from_server()
+                await self.connect_to_server()
+                if multiple:
+                    await self._modbus.write_multiple_holding_registers(register, values, self._mb_slaveid)
+                else:
+                    await self._modbus.write_holding_register(register, values[0], self._mb_slaveid)
             except Exception as e:
-                log.warning(f"Service Call: write_holding_register : [{register}], value : [{value}] failed with exception [{type(e).__name__}: {e}]")
-                self.disconnect_from_server()
+                if is_transport_error(e):
+                    await self.disconnect_from_server()
                 raise e
+
+    async def service_write_holding_register(self, register, value):
+        log.debug(f'Service Call: write_holding_register : [{register}], value : [{value}]')
+        try:
+            # Resolved once the value, or a later one for the same register, is written
+            await self._writes.write(register, [value])
+        except Exception as e:
+            log.warning(f"Service Call: write_holding_register : [{register}], value : [{value}] failed with exception [{type(e).__name__}: {e}]")
+            raise e
         return
 
-    def service_write_multiple_holding_registers(self, register, values):
+    async def service_write_multiple_holding_registers(self, register, values):
         log.debug(f'Service Call: write_multiple_holding_registers: [{register}], values : [{values}]')
-        with self.lock:
-            try:
-                wasConnected = self.is_connected_to_server()
-                self.connect_to_server()
-                self._modbus.write_multiple_holding_registers(register, values)
-                if (not wasConnected):
-                    self.disconnect_from_server()
-            except Exception as e:
-                log.warning(f"Service Call: write_multiple_holding_registers: [{register}], values : [{values}] failed with exception [{type(e).__name__}: {e}]")
-                self.disconnect_from_server()
-                raise e
+        try:
+            # Resolved once the values, or later ones for the same registers, are written
+            await self._writes.write(register, values, True)
+        except Exception as e:
+            log.warning(f"Service Call: write_multiple_holding_registers: [{register}], values : [{values}] failed with exception [{type(e).__name__}: {e}]")
+            raise e
         return
 
+    async def service_write_registers(self, values, verify = False):
+        # Write a {register: value} map with as few function 16 frames as possible. The frames, and the read back with
+        #  verify, are sent as one entry of the write queue and under one hold of the connection, so that no poll reads
+        #  the registers half written.
+        #  Returns {register: result}, the result holding the value, whether it was written and, with verify, whether
+        #  the value read back matches; failed registers also get the error.
+        log.debug(f'Service Call: write_registers : [{values}], verify : [{verify}]')
+        results = {register: {'value': value, 'written': False} for register, value in values.items()}
+        runs = group_registers(values)
+
+        def fail(registers, e):
+            for register in registers:
+                results[register]['error'] = f'{type(e).__name__}: {e}'
+
+        async def write(runs):
+            async with self._connection.lock.priority(PRIORITY_WRITE):
+                try:
+                    await self.connect_to_server()
+                except Exception as e:
+                    log.warning(f"Service Call: write_registers : [{values}] failed with exception [{type(e).__name__}: {e}]")
+                    raise e
+
+                for register, run in runs:
+                    registers = range(register, register + len(run))
+                    try:
+                        await self._modbus.write_multiple_holding_registers(register, run, self._mb_slaveid)
+                    except Exception as e:
+                        log.warning(f"Service Call: write_registers : [{register}], values : [{run}] failed with exception [{type(e).__name__}: {e}]")
+                        fail(registers, e)
+                        if is_transport_error(e):
+                            await self.disconnect_from_server()
+                            break
+                        continue
+                    for r in registers:
+                        results[r]['written'] = True
+
+                if verify and self._modbus is not None:
+                    for register, run in runs:
+                        registers = range(register, register + len(run))
+                        if not results[register]['written']:
+                            continue
+                        try:
+                            response = await self._modbus.read_holding_registers(register, len(run), self._mb_slaveid)
+                        except Exception as e:
+                            log.warning(f"Service Call: write_registers : reading back [{register}] failed with exception [{type(e).__name__}: {e}]")
+                            fail(registers, e)
+                            for r in registers:
+                                results[r]['verified'] = False
+                            if is_transport_error(e):
+                                await self.disconnect_from_server()
+                                break
+                            continue
+                        for r, value in zip(registers, response):
+                            results[r]['verified'] = value == results[r]['value']
+                            if not results[r]['verified']:
+                                results[r]['read'] = value
+                                log.warning(f"Service Call: write_registers : register [{r}] reads [{value}] after writing [{results[r]['value']}]")
+            return results
+
+        # Resolved once every frame is written, after the writes waiting before it
+        await self._writes.write_batch(runs, write)
+        log.info(f'Service Call: write_registers : [{len(values)}] registers in [{len(runs)}] frames, results [{results}]')
+        return results
+
+    async def service_read_fields(self, names, max_age = None):
+        # Read parameters of the definition by name, decoded as the entities are, with as few requests as possible.
+        #  Values from a poll at most max_age seconds old are returned without querying the inverter.
+        log.debug(f'Service Call: read_fields : [{names}], max_age : [{max_age}]')
+        items = {j['name']: j for i in self.parameter_definition['parameters'] for j in i['items']}
+        unknown = [name for name in names if name not in items]
+        if unknown:
+            raise ValueError(f'Unknown parameters {unknown} in {self.lookup_file}')
+
+        result = {}
+        if max_age is not None:
+            now = time.monotonic()
+            for values, updated in zip(self._block_values, self._block_updated):
+                if updated is not None and now - updated <= max_age:
+                    result.update((name, values[name]) for name in names if name in values and name not in result)
+        missing = [items[name] for name in names if name not in result]
+        if not missing:
+            return {name: result[name] for name in names}
+
+        # The planner works out the fewest spans covering the parameters, whatever the gaps between them
+        definition = {'requests': self.parameter_definition['requests'], 'parameters': [{'group': 'read_fields', 'items': missing}]}
+        requests = plan_requests(definition, PLANNER_MAX_REGISTERS, PLANNER_MAX_REGISTERS)
+        params = ParameterParser(definition)
+        async with self._connection.lock:
+            for request in requests:
+                start = request['start']
+                length = request['end'] - start + 1
+                try:
+                    await self.connect_to_server()
+                    if request['mb_functioncode'] == 4:
+                        response = await self._modbus.read_input_registers(start, length, self._mb_slaveid)
+                    else:
+                        response = await self._modbus.read_holding_registers(start, length, self._mb_slaveid)
+                except Exception as e:
+                    log.warning(f"Service Call: read_fields : [{start} - {request['end']}] failed with exception [{type(e).__name__}: {e}]")
+                    if is_transport_error(e):
+                        await self.disconnect_from_server()
+                    raise e
+                params.parse(response, start, length)
+
+        values = params.get_result()
+        # Parameters failing their validation are reported without a value
+        result.update((j['name'], values.get(j['name'])) for j in missing)
+        log.info(f'Service Call: read_fields : [{len(missing)}] parameters in [{len(requests)}] requests, values [{result}]')
+        return {name: result[name] for name in names}
@@ -0,0 +1,118 @@
+import asyncio
+import logging
+import time
+
+log = logging.getLogger(__name__)
+
+# Seconds between two writes to the inverter, unless the definition sets write_interval
+DEFAULT_WRITE_INTERVAL = 1
+
+
+#############################################################################################################
+# Queue of the register writes of an inverter.
+#  Writes are sent one at a time, at least min_interval seconds apart, to spare the EEPROM of the inverter.
+#  A write of registers that a waiting write also covers takes its place (the last value wins): it is either
+#  merged into that write, or the waiting writes it overwrites entirely are dropped, and their callers are
+#  answered when it is written. A batch of writes goes out as one entry, by a writer of its own, and is
+#  never merged into nor dropped for a later write.
+#############################################################################################################
+
+def overlaps(runs, other):
+    return any(r < o + len(ov) and o < r + len(rv) for r, rv in runs for o, ov in other)
+
+
+def covers(runs, other):
+    # Whether every register written by other is also written by runs
+    return all(any(r <= o and o + len(ov) <= r + len(rv) for r, rv in runs) for o, ov in other)
+
+
+class WriteQueue:
+    def __init__(self, write, min_interval = DEFAULT_WRITE_INTERVAL):
+        # write(register, values, multiple) sends one write of the values from register on to the inverter
+        self._write = write
+        self.min_interval = min_interval
+        # The writes waiting, in order, as [runs, multiple, futures, writer]: runs is a list of [register, values],
+        #  of a single run unless the entry is a batch, and writer is None unless the entry is a batch
+        self._pending = []
+        self._task = None
+        self._last_write = None
+
+    def write(self, register, values, multiple = False):
+        # Return a future resolved once the values are written from register on, with function code 16 if multiple
+        future = asyncio.get_running_loop().create_future()
+        runs = [[register, list(values)]]
+        overlapping = [p for p in self._pending if overlaps(p[0], runs)]
+        last = overlapping[-1] if overlapping else None
+        if last is not None and last[3] is None and covers(last[0], runs):
+            # No write waiting after it covers these registers, so the new values can replace its own
+            start, pending = last[0][0]
+            log.debug(f"Write of {values} from register [{register}] merged into the write of {pending} from [{start}] waiting to be written")
+            pending[register - start:register - start + len(values)] = values
+            last[1] = last[1] or multiple
+            last[2].append(future)
+        else:
+            self._append([runs, multiple, [future], None], overlapping)
+        return future
+
+    def write_batch(self, runs, writer):
+        # Return a future resolved with the result of writer(runs), which writes all the runs [(register, values)]
+        #  at once; the runs of a batch are not spaced out
+        future = asyncio.get_running_loop().create_future()
+        runs = [[register, list(values)] for register, values in runs]
+        self._append([runs, True, [future], writer], [p for p in self._pending if overlaps(p[0], runs)])
+        return future
+
+    def _append(self, entry, overlapping):
+        for p in overlapping:
+            if p[3] is None and covers(entry[0], p[0]):
+                log.debug(f"Write of {entry[0]} replaces the write of {p[0]} waiting to be written")
+                self._pending.remove(p)
+                entry[2].extend(p[2])
+        self._pending.append(entry)
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        try:
+            while self._pending:
+                if self._last_write is not None:
+                    delay = self._last_write + self.min_interval - time.monotonic()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                runs, multiple, futures, writer = self._pending.pop(0)
+                try:
+                    if writer is None:
+                        register, values = runs[0]
+                        result = await self._write(register, values, multiple)
+                    else:
+                        result = await writer(runs)
+                except asyncio.CancelledError:
+                    for future in futures:
+                        future.cancel()
+                    raise
+                except Exception as e:
+                    for future in futures:
+                        if not future.done():
+                            future.set_exception(e)
+                else:
+                    for future in futures:
+                        if not future.done():
+                            future.set_result(result)
+                finally:
+                    self._last_write = time.monotonic()
+        finally:
+            self._task = None
+
+    async def close(self):
+        task = self._task
+        if task:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        for runs, multiple, futures, writer in self._pending:
+            for future in futures:
+                if not future.done():
+                    future.set_exception(ConnectionError('Inverter closed'))
+        self._pending = []